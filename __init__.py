@@ -31,16 +31,55 @@ from importlib import reload
 if __name__ == "__main__":
     from blender2luminous import auto_load
     from blender2luminous import material_nodes
+    from blender2luminous import morton
+    from blender2luminous import mesh_io
+    from blender2luminous import export_cache
+    from blender2luminous import worker_pool
+    from blender2luminous import scene_builder
+    from blender2luminous import profiler
+    from blender2luminous import framebuffer
+    from blender2luminous import texture_processing
+    from blender2luminous import envmap_sampling
+    from blender2luminous import light_tables
+    from blender2luminous import scene_bvh
+    from blender2luminous import cli
+    from blender2luminous import live_sync
     from blender2luminous import render_panel
     from blender2luminous import render_exporter
 
     reload(auto_load)
     reload(material_nodes)
+    reload(morton)
+    reload(mesh_io)
+    reload(export_cache)
+    reload(worker_pool)
+    reload(scene_builder)
+    reload(profiler)
+    reload(framebuffer)
+    reload(texture_processing)
+    reload(envmap_sampling)
+    reload(light_tables)
+    reload(scene_bvh)
+    reload(cli)
+    reload(live_sync)
     reload(render_panel)
     reload(render_exporter)
 else:
     from . import auto_load
     from . import material_nodes
+    from . import morton
+    from . import mesh_io
+    from . import export_cache
+    from . import worker_pool
+    from . import scene_builder
+    from . import profiler
+    from . import framebuffer
+    from . import texture_processing
+    from . import envmap_sampling
+    from . import light_tables
+    from . import scene_bvh
+    from . import cli
+    from . import live_sync
     from . import render_panel
     from . import render_exporter
 
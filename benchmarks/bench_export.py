@@ -0,0 +1,404 @@
+"""Exporter throughput on synthetic scenes.
+
+Without blender, against the stand-ins in fake_bpy (needs numpy):
+
+    python benchmarks/bench_export.py --meshes 200 --triangles 20000
+
+Inside blender, against real datablocks (start from an empty file, the
+benchmark scene replaces whatever is loaded):
+
+    blender --background --factory-startup --python benchmarks/bench_export.py -- --meshes 200
+
+Reports objects/s, triangles/s and MB/s per benchmark, --json writes the
+numbers for comparing runs.
+"""
+import os
+import sys
+import json
+import math
+import time
+import types
+import shutil
+import argparse
+import tempfile
+import importlib
+
+import numpy as np
+
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ADDON_DIR = os.path.dirname(BENCH_DIR)
+
+
+def parse_args():
+    argv = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else sys.argv[1:]
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--meshes', type=int, default=100, help='unique mesh objects')
+    parser.add_argument('--triangles', type=int, default=20000, help='triangles per mesh')
+    parser.add_argument('--large-triangles', type=int, default=2000000, help='triangles of the single large mesh')
+    parser.add_argument('--instances', type=int, default=1000, help='objects sharing one mesh datablock')
+    parser.add_argument('--lights', type=int, default=10000, help='point lights')
+    parser.add_argument('--area-lights', type=int, default=1000, help='area lights')
+    parser.add_argument('--textures', type=int, default=20, help='textured materials')
+    parser.add_argument('--texture-kb', type=int, default=1024, help='texture file size (stand-in only)')
+    parser.add_argument('--format', choices=['.ply', '.lmesh'], default='.ply', help='mesh file format')
+    parser.add_argument('--threads', type=int, default=0, help='export_threads, 0 uses all cores')
+    parser.add_argument('--output', default=None,
+                        help='keep the export in a new folder created under this one, a temp dir by default')
+    parser.add_argument('--json', default=None, help='write results to this file')
+    return parser.parse_args(argv)
+
+
+# Scene construction
+#################################################
+
+def grid_arrays(triangles):
+    # a k x k quad grid with per loop normals and uvs, like blender hands them out
+    k = max(1, int(math.ceil(math.sqrt(triangles / 2.0))))
+    xs, ys = np.meshgrid(np.arange(k + 1, dtype=np.float32), np.arange(k + 1, dtype=np.float32))
+    co = np.stack([xs.ravel() / k, ys.ravel() / k, np.zeros(xs.size, np.float32)], axis=1)
+
+    qx, qy = np.meshgrid(np.arange(k), np.arange(k))
+    v0 = (qy * (k + 1) + qx).ravel()
+    loop_vertices = np.stack([v0, v0 + 1, v0 + k + 2, v0 + k + 1], axis=1).ravel().astype(np.int32)
+
+    loop_normals = np.tile(np.array([0, 0, 1], np.float32), (len(loop_vertices), 1))
+    loop_uvs = co[loop_vertices, 0:2].copy()
+
+    quad_loops = np.arange(0, len(loop_vertices), 4, dtype=np.int32)[:, None]
+    triangles = np.concatenate([quad_loops + [0, 1, 2], quad_loops + [0, 2, 3]], axis=1).reshape(-1, 3)
+    return co, loop_vertices, loop_normals, loop_uvs, triangles.astype(np.int32), k * k
+
+
+def placement(i):
+    return [[1, 0, 0, (i % 100) * 2.0],
+            [0, 1, 0, (i // 100) * 2.0],
+            [0, 0, 1, 0],
+            [0, 0, 0, 1]]
+
+
+class FakeSceneBuilder:
+    def __init__(self, fake_bpy, material_nodes, src_dir):
+        self.fake = fake_bpy
+        self.material_nodes = material_nodes
+        self.src_dir = src_dir
+
+    def mesh(self, name, triangles):
+        co, loop_vertices, normals, uvs, tris, polygons = grid_arrays(triangles)
+        return self.fake.Mesh(name, co, loop_vertices, normals, uvs, tris,
+                              np.zeros(len(tris), np.int32), polygons)
+
+    def object(self, name, type, data, i):
+        return self.fake.Object(name, type, data, self.fake.Matrix(placement(i)))
+
+    def light(self, name, type):
+        return type_namespace(name=name, type=type, color=(1.0, 1.0, 1.0), energy=10.0,
+                              shape='RECTANGLE', size=1.0, size_y=0.5)
+
+    def camera(self):
+        return type_namespace(name='camera', type='PERSP', angle_y=0.6)
+
+    def textured_material(self, name, texture_kb):
+        filepath = os.path.join(self.src_dir, name + '.png')
+        with open(filepath, 'wb') as f:
+            f.write(os.urandom(texture_kb * 1024))
+        node = self.material_nodes.LuminousMatte()
+        node.Kd = (0.8, 0.8, 0.8, 1.0)
+        node.inputs = [type_namespace(links=[self.fake.image_link(filepath)])]
+        return self.fake.Material(name, [node])
+
+    def link(self, scene, obj, material=None):
+        if material is not None:
+            obj.material_slots.append(type_namespace(material=material))
+        scene.objects.append(obj)
+
+
+def type_namespace(**kwargs):
+    return types.SimpleNamespace(**kwargs)
+
+
+class BlenderSceneBuilder:
+    def __init__(self, bpy, src_dir):
+        self.bpy = bpy
+        self.src_dir = src_dir
+
+    def mesh(self, name, triangles):
+        co, loop_vertices, normals, uvs, tris, polygons = grid_arrays(triangles)
+        mesh = self.bpy.data.meshes.new(name)
+        mesh.vertices.add(len(co))
+        mesh.vertices.foreach_set('co', co.ravel())
+        mesh.loops.add(len(loop_vertices))
+        mesh.loops.foreach_set('vertex_index', loop_vertices)
+        mesh.polygons.add(polygons)
+        mesh.polygons.foreach_set('loop_start', np.arange(0, len(loop_vertices), 4, dtype=np.int32))
+        mesh.polygons.foreach_set('loop_total', np.full(polygons, 4, np.int32))
+        mesh.uv_layers.new()
+        mesh.uv_layers.active.data.foreach_set('uv', uvs.ravel())
+        mesh.update(calc_edges=True)
+        return mesh
+
+    def object(self, name, type, data, i):
+        import mathutils
+        obj = self.bpy.data.objects.new(name, data)
+        obj.matrix_world = mathutils.Matrix(placement(i))
+        return obj
+
+    def light(self, name, type):
+        light = self.bpy.data.lights.new(name, type)
+        if type == 'AREA':
+            light.shape = 'RECTANGLE'
+            light.size_y = 0.5
+        return light
+
+    def camera(self):
+        return self.bpy.data.cameras.new('camera')
+
+    def textured_material(self, name, texture_kb):
+        side = max(1, int(math.sqrt(texture_kb * 1024 / 4)))
+        image = self.bpy.data.images.new(name, side, side)
+        image.filepath_raw = os.path.join(self.src_dir, name + '.png')
+        image.file_format = 'PNG'
+        image.save()
+        mat = self.bpy.data.materials.new(name)
+        mat.use_nodes = True
+        matte = mat.node_tree.nodes.new('CustomNodeTypeMatte')
+        tex = mat.node_tree.nodes.new('ShaderNodeTexImage')
+        tex.image = image
+        mat.node_tree.links.new(tex.outputs[0], matte.inputs[0])
+        return mat
+
+    def link(self, scene, obj, material=None):
+        if material is not None:
+            obj.data.materials.append(material)
+        scene.collection.objects.link(obj)
+
+
+def build_scene(builder, scene, args):
+    counts = {'objects': 0, 'triangles': 0}
+
+    materials = [builder.textured_material('tex_%d' % i, args.texture_kb) for i in range(args.textures)]
+    for i in range(args.meshes):
+        mesh = builder.mesh('mesh_%d' % i, args.triangles)
+        material = materials[i % len(materials)] if materials else None
+        builder.link(scene, builder.object('mesh_%d' % i, 'MESH', mesh, i), material)
+        counts['objects'] += 1
+        counts['triangles'] += args.triangles
+
+    shared = builder.mesh('shared', args.triangles)
+    for i in range(args.instances):
+        builder.link(scene, builder.object('instance_%d' % i, 'MESH', shared, args.meshes + i))
+        counts['objects'] += 1
+        counts['triangles'] += args.triangles
+
+    for i in range(args.lights):
+        builder.link(scene, builder.object('point_%d' % i, 'LIGHT', builder.light('point_%d' % i, 'POINT'), i))
+    for i in range(args.area_lights):
+        builder.link(scene, builder.object('area_%d' % i, 'LIGHT', builder.light('area_%d' % i, 'AREA'), i))
+
+    camera = builder.object('camera', 'CAMERA', builder.camera(), 0)
+    builder.link(scene, camera)
+    scene.camera = camera
+    return counts
+
+
+# Addon loading
+#################################################
+
+def load_addon():
+    try:
+        import bpy
+        stand_in = False
+    except ImportError:
+        sys.path.insert(0, BENCH_DIR)
+        import fake_bpy
+        bpy = fake_bpy.install()
+        stand_in = True
+
+    # auto_load imports submodules under the folder name, so import it as such
+    package = os.path.basename(ADDON_DIR)
+    if package not in sys.modules:
+        sys.path.insert(0, os.path.dirname(ADDON_DIR))
+    addon = importlib.import_module(package)
+    if not hasattr(bpy.types.Scene, 'exportpath'):
+        addon.register()
+    return bpy, addon, stand_in
+
+
+def new_scene(bpy, stand_in):
+    if stand_in:
+        import fake_bpy
+        scene = fake_bpy.FakeScene()
+        bpy.data.scenes[:] = [scene]
+        bpy.context.scene = scene
+        return scene
+    scene = bpy.context.scene
+    for obj in list(scene.objects):
+        bpy.data.objects.remove(obj)
+    return scene
+
+
+# Benchmarks
+#################################################
+
+def dir_size(path):
+    total = 0
+    for root, dirs, files in os.walk(path):
+        total += sum(os.path.getsize(os.path.join(root, f)) for f in files)
+    return total
+
+
+def clear_dir(path):
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.makedirs(path)
+
+
+def check_lmesh(mesh_io, work_dir, mesh_dir):
+    '''write_lmesh/read_lmesh round trip on a grid mesh, then every exported .lmesh
+    is read back against its own header, raises on any mismatch'''
+    co, loop_vertices, normals, uvs, tris, _ = grid_arrays(1000)
+    data = mesh_io.MeshData(co[loop_vertices], normals, uvs, tris.view(np.uint32),
+                            np.arange(len(tris), dtype=np.int32) % 3)
+    filepath = os.path.join(work_dir, 'roundtrip' + mesh_io.LMESH_EXTENSION)
+    mesh_io.write_lmesh(filepath, data)
+    read = mesh_io.read_lmesh(filepath)
+    for name in mesh_io.LMESH_ATTRIBUTES:
+        a, b = getattr(data, name), getattr(read, name)
+        if a.shape != b.shape or a.tobytes() != b.tobytes():
+            raise AssertionError('lmesh round trip changed ' + name)
+
+    files = [os.path.join(root, f) for root, dirs, fs in os.walk(mesh_dir)
+             for f in fs if f.endswith(mesh_io.LMESH_EXTENSION)]
+    for filepath in files + [os.path.join(work_dir, 'roundtrip' + mesh_io.LMESH_EXTENSION)]:
+        with open(filepath, 'rb') as f:
+            raw = f.read()
+        num_attributes = mesh_io.LMESH_HEADER.unpack_from(raw, 0)[4]
+        for i in range(num_attributes):
+            record = mesh_io.LMESH_HEADER.size + i * mesh_io.LMESH_ATTRIBUTE.size
+            offset = mesh_io.LMESH_ATTRIBUTE.unpack_from(raw, record)[4]
+            # the u64 fields must be naturally aligned for a c reader, arrays start on a page
+            if record % 8 or offset % mesh_io.LMESH_PAGE:
+                raise AssertionError('misaligned lmesh layout in ' + filepath)
+        mesh = mesh_io.read_lmesh(filepath)
+        if len(mesh.indices) and int(mesh.indices.max()) >= mesh.num_vertices:
+            raise AssertionError('lmesh indices out of range in ' + filepath)
+    print('lmesh round trip ok, %d exported files checked' % len(files))
+
+
+def run(name, fn, objects=0, triangles=0, size_of=None):
+    start = time.perf_counter()
+    fn()
+    seconds = time.perf_counter() - start
+    nbytes = size_of() if size_of is not None else 0
+    return {
+        'name': name,
+        'seconds': seconds,
+        'objects': objects,
+        'triangles': triangles,
+        'bytes': nbytes,
+        'objects_per_s': objects / seconds if seconds > 0 else 0.0,
+        'triangles_per_s': triangles / seconds if seconds > 0 else 0.0,
+        'mb_per_s': nbytes / 1e6 / seconds if seconds > 0 else 0.0,
+    }
+
+
+def benchmark(bpy, addon, stand_in, args, out_dir, src_dir):
+    render_exporter = addon.render_exporter
+    scene_builder = addon.scene_builder
+    scene = new_scene(bpy, stand_in)
+    builder = FakeSceneBuilder(sys.modules['fake_bpy'], addon.material_nodes, src_dir) if stand_in \
+        else BlenderSceneBuilder(bpy, src_dir)
+
+    counts = build_scene(builder, scene, args)
+    scene.exportpath = out_dir + '/'
+    scene.file_format = args.format
+    scene.use_export_cache = False
+    scene.export_threads = args.threads
+    mesh_dir = os.path.join(out_dir, 'meshes')
+    texture_dir = os.path.join(out_dir, 'textures')
+    results = []
+
+    large = builder.object('large', 'MESH', builder.mesh('large', args.large_triangles), 0)
+    clear_dir(mesh_dir)
+    results.append(run('export_mesh (large)',
+                       lambda: render_exporter.export_mesh(scene, scene_builder.SceneBuilder(), large, '', 0),
+                       1, args.large_triangles, lambda: dir_size(mesh_dir)))
+
+    depsgraph = bpy.context.evaluated_depsgraph_get()
+    objects = {}
+    results.append(run('collect_export_objects',
+                       lambda: objects.update(render_exporter.collect_export_objects(depsgraph)),
+                       len(scene.objects)))
+
+    clear_dir(mesh_dir)
+    clear_dir(texture_dir)
+    results.append(run('export_meshes',
+                       lambda: render_exporter.export_meshes(scene, scene_builder.SceneBuilder(), objects['MESH']),
+                       counts['objects'], counts['triangles'], lambda: dir_size(out_dir)))
+
+    scene.use_export_cache = True
+    cache = addon.export_cache.ExportCache(out_dir)
+    render_exporter.export_meshes(scene, scene_builder.SceneBuilder(), objects['MESH'], cache)
+    results.append(run('export_meshes (cached)',
+                       lambda: render_exporter.export_meshes(scene, scene_builder.SceneBuilder(), objects['MESH'], cache),
+                       counts['objects'], counts['triangles']))
+    scene.use_export_cache = False
+
+    num_lights = args.lights + args.area_lights
+    light_json = scene_builder.SceneBuilder()
+    def export_lights():
+        render_exporter.export_point_lights(scene, light_json, objects['LIGHT'])
+        render_exporter.export_area_lights(scene, light_json, objects['LIGHT'])
+    results.append(run('export_lights', export_lights, num_lights))
+
+    scene_json_path = os.path.join(out_dir, 'lights.json')
+    results.append(run('export_scene', lambda: light_json.write(scene_json_path),
+                       len(light_json.shapes) + len(light_json.lights), 0,
+                       lambda: os.path.getsize(scene_json_path)))
+
+    if args.format == '.lmesh':
+        check_lmesh(addon.mesh_io, src_dir, mesh_dir)
+
+    clear_dir(out_dir)
+    results.append(run('export_luminous', lambda: render_exporter.export_luminous(out_dir, scene),
+                       len(scene.objects), counts['triangles'], lambda: dir_size(out_dir)))
+    return results
+
+
+def print_results(results):
+    print('%-26s %9s %12s %14s %10s' % ('benchmark', 'seconds', 'objects/s', 'triangles/s', 'MB/s'))
+    for r in results:
+        print('%-26s %9.3f %12.0f %14.0f %10.1f' % (r['name'], r['seconds'], r['objects_per_s'],
+                                                   r['triangles_per_s'], r['mb_per_s']))
+
+
+def main():
+    args = parse_args()
+    bpy, addon, stand_in = load_addon()
+    print('running against', 'stand-in bpy' if stand_in else 'blender ' + bpy.app.version_string)
+
+    work_dir = tempfile.mkdtemp(prefix='luminous_bench_')
+    # the benchmark clears its export folder between runs, so it only ever
+    # exports into a folder it created itself
+    if args.output:
+        os.makedirs(args.output, exist_ok=True)
+        out_dir = tempfile.mkdtemp(prefix='export_', dir=args.output)
+        print('exporting to', out_dir)
+    else:
+        out_dir = os.path.join(work_dir, 'export')
+    src_dir = os.path.join(work_dir, 'src')
+    os.makedirs(out_dir, exist_ok=True)
+    os.makedirs(src_dir, exist_ok=True)
+    try:
+        results = benchmark(bpy, addon, stand_in, args, out_dir, src_dir)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print_results(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'args': vars(args), 'stand_in': stand_in, 'results': results}, f, indent=4)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,264 @@
+"""Lightweight stand-ins for the bpy/mathutils pieces the exporter touches.
+
+Only good enough to drive render_exporter outside of blender for benchmarks:
+meshes are plain numpy buffers behind foreach_get, objects are already
+"evaluated" and the depsgraph just lists them.
+"""
+import os
+import sys
+import types
+
+import numpy as np
+
+
+# bpy
+#################################################
+
+def make_property(kind):
+    # like blender 2.8+, a property definition is a (function, keywords) tuple
+    def prop(**kwargs):
+        return (prop, kwargs)
+    prop.__name__ = kind
+    return prop
+
+
+class Matrix:
+    def __init__(self, rows=None):
+        self.rows = np.identity(4) if rows is None else np.array(rows, dtype=np.float64)
+
+    @property
+    def col(self):
+        return [list(c) for c in self.rows.T]
+
+    @property
+    def translation(self):
+        return Vector(self.rows[0:3, 3])
+
+    def copy(self):
+        return Matrix(self.rows.copy())
+
+    def __array__(self, dtype=None, copy=None):
+        return self.rows if dtype is None else self.rows.astype(dtype)
+
+    def __iter__(self):
+        return iter(self.rows.tolist())
+
+    def __len__(self):
+        return 4
+
+    def __getitem__(self, i):
+        return self.rows[i]
+
+    @staticmethod
+    def Translation(v):
+        m = Matrix()
+        m.rows[0:3, 3] = v
+        return m
+
+
+class Vector(tuple):
+    def __new__(cls, values=(0.0, 0.0, 0.0)):
+        return tuple.__new__(cls, (float(v) for v in values))
+
+    x = property(lambda self: self[0])
+    y = property(lambda self: self[1])
+    z = property(lambda self: self[2])
+
+
+class Attributes:
+    '''A bpy collection reduced to len() and foreach_get'''
+    def __init__(self, count, **arrays):
+        self.count = count
+        self.arrays = arrays
+
+    def __len__(self):
+        return self.count
+
+    def foreach_get(self, attr, buf):
+        buf[...] = self.arrays[attr].ravel()
+
+
+class UVLayers:
+    def __init__(self, uvs):
+        self.active = None if uvs is None else types.SimpleNamespace(data=Attributes(len(uvs), uv=uvs))
+
+    def __len__(self):
+        return 0 if self.active is None else 1
+
+
+class Mesh:
+    def __init__(self, name, co, loop_vertices, loop_normals, loop_uvs, triangles, material_indices, num_polygons):
+        self.name = name
+        self.vertices = Attributes(len(co), co=co)
+        self.loops = Attributes(len(loop_vertices), vertex_index=loop_vertices, normal=loop_normals)
+        self.uv_layers = UVLayers(loop_uvs)
+        self.loop_triangles = Attributes(len(triangles), loops=triangles, material_index=material_indices)
+        self.polygons = Attributes(num_polygons)
+        self.animation_data = None
+        self.shape_keys = None
+        self.materials = []
+
+    def calc_loop_triangles(self):
+        pass
+
+    def calc_normals_split(self):
+        pass
+
+    def update(self):
+        pass
+
+
+class Object:
+    def __init__(self, name, type, data, matrix_world=None):
+        self.name = name
+        self.type = type
+        self.data = data
+        self.matrix_world = matrix_world if matrix_world is not None else Matrix()
+        self.modifiers = []
+        self.material_slots = []
+        self.animation_data = None
+        self.rotation_euler = Vector()
+
+    @property
+    def original(self):
+        return self
+
+    def evaluated_get(self, depsgraph):
+        return self
+
+    def to_mesh(self):
+        return self.data
+
+    def to_mesh_clear(self):
+        pass
+
+
+class Material:
+    def __init__(self, name, nodes):
+        self.name = name
+        self.use_nodes = True
+        self.node_tree = types.SimpleNamespace(nodes=nodes, links=[])
+
+
+def image_link(filepath):
+    image = types.SimpleNamespace(name=os.path.basename(filepath), filepath=filepath)
+    return types.SimpleNamespace(from_node=types.SimpleNamespace(image=image))
+
+
+class ObjectInstance:
+    def __init__(self, object):
+        self.object = object
+        self.matrix_world = object.matrix_world
+        self.is_instance = False
+        self.parent = None
+
+
+class Collection(list):
+    '''bpy_prop_collection lookups by name'''
+    def get(self, name, default=None):
+        return next((item for item in self if item.name == name), default)
+
+
+class Depsgraph:
+    def __init__(self, objects):
+        self.objects = Collection(objects)
+        self.updates = []
+
+    @property
+    def object_instances(self):
+        for obj in self.objects:
+            yield ObjectInstance(obj)
+
+
+class Scene:
+    '''Base for bpy.types.Scene, render_panel.register() attaches the properties'''
+    pass
+
+
+class FakeScene(Scene):
+    def __init__(self, name='Scene'):
+        # every property render_panel registered starts out at its default
+        for key, value in vars(Scene).items():
+            if isinstance(value, tuple) and len(value) == 2 and isinstance(value[1], dict):
+                setattr(self, key, value[1].get('default'))
+        self.name = name
+        self.objects = []
+        self.camera = None
+        self.frame_current = 1
+        self.render = types.SimpleNamespace(resolution_x=1920, resolution_y=1080)
+
+    def frame_set(self, frame):
+        self.frame_current = frame
+
+
+def make_type(name):
+    return type(name, (), {})
+
+
+def install():
+    '''Register the stand-ins in sys.modules, returns the fake bpy module'''
+    bpy = types.ModuleType('bpy')
+    bpy.IS_STAND_IN = True
+
+    bpy.props = types.ModuleType('bpy.props')
+    for kind in ['BoolProperty', 'IntProperty', 'FloatProperty', 'StringProperty', 'EnumProperty',
+                 'FloatVectorProperty', 'IntVectorProperty', 'PointerProperty', 'CollectionProperty']:
+        setattr(bpy.props, kind, make_property(kind))
+
+    bpy.types = types.ModuleType('bpy.types')
+    for name in ['Panel', 'Operator', 'PropertyGroup', 'AddonPreferences', 'Header', 'Menu',
+                 'Node', 'NodeSocket', 'NodeTree', 'UIList', 'RenderEngine', 'Object', 'Mesh']:
+        setattr(bpy.types, name, make_type(name))
+    bpy.types.Scene = Scene
+
+    bpy.utils = types.SimpleNamespace(register_class=lambda cls: None,
+                                      unregister_class=lambda cls: None)
+    bpy.path = types.SimpleNamespace(abspath=lambda path: path[2:] if path.startswith('//') else path)
+    bpy.app = types.SimpleNamespace(
+        version=(2, 93, 0),
+        version_string='2.93.0 (stand-in)',
+        background=True,
+        handlers=types.SimpleNamespace(depsgraph_update_post=[], load_post=[], persistent=lambda fn: fn),
+        timers=types.SimpleNamespace(register=lambda fn, first_interval=0: None,
+                                     is_registered=lambda fn: False,
+                                     unregister=lambda fn: None),
+    )
+    bpy.data = types.SimpleNamespace(scenes=[], objects=[], cameras=[], lights=[], materials=[])
+    bpy.context = types.SimpleNamespace(scene=None, view_layer=types.SimpleNamespace(update=lambda: None))
+
+    def evaluated_depsgraph_get():
+        return Depsgraph(bpy.context.scene.objects)
+    bpy.context.evaluated_depsgraph_get = evaluated_depsgraph_get
+
+    mathutils = types.ModuleType('mathutils')
+    mathutils.Matrix = Matrix
+    mathutils.Vector = Vector
+
+    bl_ui = types.ModuleType('bl_ui')
+    bl_ui.properties_render = types.ModuleType('bl_ui.properties_render')
+    bl_ui.properties_material = types.ModuleType('bl_ui.properties_material')
+
+    nodeitems_utils = types.ModuleType('nodeitems_utils')
+    class NodeCategory:
+        def __init__(self, identifier, name, description="", items=None):
+            self.identifier = identifier
+            self.name = name
+            self.items = items
+    nodeitems_utils.NodeCategory = NodeCategory
+    nodeitems_utils.NodeItem = lambda nodetype, **kwargs: nodetype
+    nodeitems_utils.NodeItemCustom = lambda **kwargs: None
+    nodeitems_utils.register_node_categories = lambda identifier, categories: None
+    nodeitems_utils.unregister_node_categories = lambda identifier: None
+
+    sys.modules.update({
+        'bpy': bpy,
+        'bpy.props': bpy.props,
+        'bpy.types': bpy.types,
+        'mathutils': mathutils,
+        'bmesh': types.ModuleType('bmesh'),
+        'bl_ui': bl_ui,
+        'bl_ui.properties_render': bl_ui.properties_render,
+        'bl_ui.properties_material': bl_ui.properties_material,
+        'nodeitems_utils': nodeitems_utils,
+    })
+    return bpy
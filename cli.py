@@ -0,0 +1,157 @@
+"""Headless export for render farms.
+
+    blender --background scene.blend --python-exit-code 1 \\
+        --python path/to/blender2luminous/cli.py -- --export-dir /out/shot010/ --scene Scene
+
+or, with the addon enabled,
+
+    blender --background scene.blend \\
+        --python-expr "from blender2luminous import cli; cli.main()" -- --export-dir /out/shot010/
+
+Everything after "--" is parsed here. A one line JSON summary is printed
+(prefixed with LUMINOUS_EXPORT_SUMMARY) and optionally written to --summary.
+Exit codes: 0 exported, 1 export failed, 2 bad arguments.
+"""
+import os
+import sys
+import json
+import argparse
+import importlib
+import traceback
+
+import bpy
+
+
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_BAD_ARGS = 2
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog='cli.py', description='Export a blender scene for the luminous renderer')
+    parser.add_argument('--export-dir', required=True, help='output folder, scene.json is written here')
+    parser.add_argument('--scene', default=None, help='scene name, the active scene by default')
+    parser.add_argument('--frame', type=int, default=None, help='export a single frame')
+    parser.add_argument('--frame-start', type=int, default=None, help='first frame of an animation export')
+    parser.add_argument('--frame-end', type=int, default=None, help='last frame of an animation export')
+    parser.add_argument('--format', choices=['.ply', '.gltf', '.lmesh'], default=None, help='mesh file format')
+    parser.add_argument('--resolution', type=int, nargs=2, default=None, metavar=('X', 'Y'))
+    parser.add_argument('--spp', type=int, default=None, help='samples per pixel')
+    parser.add_argument('--output', default=None, help='renderer output image file name')
+    parser.add_argument('--threads', type=int, default=None, help='mesh writer threads, 0 uses all cores')
+    parser.add_argument('--compact', action='store_true', help='write compact scene.json')
+    parser.add_argument('--stream', action='store_true', help='stream shapes and lights (implies --compact)')
+    parser.add_argument('--no-cache', action='store_true', help='rewrite every file')
+    parser.add_argument('--trace', action='store_true', help='write export_trace.json')
+    parser.add_argument('--summary', default=None, help='also write the JSON summary to this file')
+    return parser.parse_args(argv)
+
+
+def import_addon():
+    # works both for an enabled addon and for a checkout passed with --python
+    package = os.path.basename(os.path.dirname(os.path.abspath(__file__)))
+    if package not in sys.modules:
+        sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    addon = importlib.import_module(package)
+    if not hasattr(bpy.types.Scene, 'exportpath'):
+        addon.register()
+    return addon
+
+
+def configure_scene(scene, args):
+    export_dir = os.path.abspath(bpy.path.abspath(args.export_dir))
+    # meshes and textures are resolved against scene.exportpath
+    scene.exportpath = os.path.join(export_dir, '')
+    if args.format is not None:
+        scene.file_format = args.format
+    if args.resolution is not None:
+        scene.resolution_x, scene.resolution_y = args.resolution
+    if args.spp is not None:
+        scene.spp = args.spp
+    if args.output is not None:
+        scene.outputfilename = args.output
+    if args.threads is not None:
+        scene.export_threads = args.threads
+    if args.compact or args.stream:
+        scene.compact_scene = True
+    if args.stream:
+        scene.stream_scene = True
+    if args.no_cache:
+        scene.use_export_cache = False
+    if args.trace:
+        scene.write_export_trace = True
+    return export_dir
+
+
+def run(args):
+    addon = import_addon()
+    render_exporter = addon.render_exporter
+    summary = {
+        'status': 'failed',
+        'blend': bpy.data.filepath,
+        'export_dir': None,
+        'scene': None,
+    }
+
+    scene = bpy.data.scenes.get(args.scene) if args.scene else bpy.context.scene
+    if scene is None:
+        summary['error'] = 'no scene named %r' % args.scene
+        return EXIT_BAD_ARGS, summary
+    summary['scene'] = scene.name
+
+    animation = args.frame_start is not None or args.frame_end is not None
+    if animation and args.frame is not None:
+        summary['error'] = '--frame and --frame-start/--frame-end are exclusive'
+        return EXIT_BAD_ARGS, summary
+
+    export_dir = configure_scene(scene, args)
+    summary['export_dir'] = export_dir
+    os.makedirs(export_dir, exist_ok=True)
+
+    try:
+        if animation:
+            scene.batch_frame_start = args.frame_start if args.frame_start is not None else scene.frame_start
+            scene.batch_frame_end = args.frame_end if args.frame_end is not None else scene.frame_end
+            result = render_exporter.export_luminous_animation(export_dir, scene)
+            summary['frames'] = len(result['frames'])
+        else:
+            if args.frame is not None:
+                scene.frame_set(args.frame)
+            scene_json = render_exporter.export_luminous(export_dir, scene)
+            summary['frames'] = 1
+            summary['shapes'] = len(scene_json.shapes)
+            summary['lights'] = len(scene_json.lights)
+    except Exception as e:
+        traceback.print_exc()
+        summary['error'] = '%s: %s' % (type(e).__name__, e)
+        return EXIT_FAILED, summary
+
+    report = addon.profiler.last
+    if report is not None:
+        summary['seconds'] = report.total_seconds()
+        summary['bytes'] = report.total_bytes()
+    summary['status'] = 'ok'
+    return EXIT_OK, summary
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else []
+    try:
+        args = parse_args(argv)
+    except SystemExit as e:
+        # argparse already printed the usage
+        sys.exit(EXIT_BAD_ARGS if e.code else EXIT_OK)
+
+    code, summary = run(args)
+    line = json.dumps(summary)
+    print('LUMINOUS_EXPORT_SUMMARY ' + line)
+    if args.summary:
+        with open(args.summary, 'w') as f:
+            f.write(line + '\n')
+    sys.stdout.flush()
+    sys.exit(code)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+import os
+import struct
+
+import numpy as np
+
+
+# Piecewise constant 2D distribution of an equirectangular environment map,
+# the tables a renderer builds for importance sampling (pbrt's Distribution2D).
+#
+# File layout, little-endian, every array 16 byte aligned:
+#   header      '4s5I'  magic, version, width, height, reserved, reserved
+#   func        float32 [height, width]      luminance * sin(theta)
+#   cdf         float32 [height, width + 1]  per row conditional cdf
+#   row_func    float32 [height]             row integrals, the marginal function
+#   row_cdf     float32 [height + 1]         marginal cdf
+#   integral    float32 [1]                  integral of the whole function
+# Rows go from the top of the image (theta = 0) down.
+
+MAGIC = b'LMDS'
+VERSION = 1
+HEADER = struct.Struct('<4s5I')
+ALIGNMENT = 16
+
+# rec. 709 luminance, light_tables weighs light colors with it too
+LUMINANCE = np.array([0.2126, 0.7152, 0.0722], dtype=np.float32)
+
+
+def luminance(pixels):
+    # of the colors along the last axis, a single channel already is luminance
+    if pixels.shape[-1] == 1:
+        return pixels[..., 0]
+    return pixels[..., :3] @ LUMINANCE
+
+
+def sin_theta(height):
+    return np.sin((np.arange(height, dtype=np.float64) + 0.5) / height * np.pi)
+
+
+def piecewise_cdf(func):
+    # along the last axis, pbrt Distribution1D: cdf[i] = sum(func[:i]) / n, normalized
+    n = func.shape[-1]
+    cdf = np.zeros(func.shape[:-1] + (n + 1,), dtype=np.float64)
+    np.cumsum(func / n, axis=-1, out=cdf[..., 1:])
+    integral = cdf[..., -1].copy()
+    empty = integral == 0
+    safe = np.where(empty, 1, integral)[..., None]
+    cdf /= safe
+    # a black row is sampled uniformly
+    if np.any(empty):
+        cdf[empty] = np.linspace(0, 1, n + 1)
+    return cdf.astype(np.float32), integral.astype(np.float32)
+
+
+def build_distribution(pixels):
+    '''pixels: float [height, width, channels], top row first'''
+    height, width = pixels.shape[:2]
+    func = (np.maximum(luminance(pixels), 0) * sin_theta(height)[:, None]).astype(np.float32)
+    cdf, row_func = piecewise_cdf(func)
+    row_cdf, integral = piecewise_cdf(row_func)
+    return {
+        'func': func,
+        'cdf': cdf,
+        'row_func': row_func,
+        'row_cdf': row_cdf,
+        'integral': np.array([integral], dtype=np.float32),
+    }
+
+
+def average_radiance(distribution):
+    # the integral averages luminance * sin(theta) over the image, divided by the
+    # average sin(theta) of the rows it is the average over the sphere
+    height = distribution['func'].shape[0]
+    return float(distribution['integral'][0]) / float(np.mean(sin_theta(height)))
+
+
+def write_distribution(filepath, distribution):
+    height, width = distribution['func'].shape
+    tmpfile = filepath + '.tmp'
+    with open(tmpfile, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, width, height, 0, 0))
+        for key in ('func', 'cdf', 'row_func', 'row_cdf', 'integral'):
+            f.write(b'\0' * (-f.tell() % ALIGNMENT))
+            np.ascontiguousarray(distribution[key], dtype='<f4').tofile(f)
+        nbytes = f.tell()
+    os.replace(tmpfile, filepath)
+    return nbytes
+
+
+def read_distribution(filepath):
+    data = np.memmap(filepath, dtype=np.uint8, mode='r')
+    magic, version, width, height, _, _ = HEADER.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise ValueError('%s is not an environment map distribution' % filepath)
+    shapes = [('func', (height, width)), ('cdf', (height, width + 1)),
+              ('row_func', (height,)), ('row_cdf', (height + 1,)), ('integral', (1,))]
+    offset = HEADER.size
+    distribution = {}
+    for key, shape in shapes:
+        offset += -offset % ALIGNMENT
+        count = int(np.prod(shape))
+        distribution[key] = np.frombuffer(data, dtype='<f4', count=count, offset=offset).reshape(shape)
+        offset += count * 4
+    return distribution
@@ -0,0 +1,194 @@
+import os
+import json
+import shutil
+import hashlib
+
+import numpy as np
+
+
+CACHE_FILENAME = 'export_cache.json'
+CACHE_VERSION = 2
+
+
+def hash_arrays(arrays, extra=''):
+    h = hashlib.blake2b(digest_size=16)
+    for a in arrays:
+        if a is None:
+            h.update(b'none')
+            continue
+        a = np.ascontiguousarray(a)
+        h.update(('%s%s' % (a.dtype.str, a.shape)).encode('utf-8'))
+        h.update(memoryview(a).cast('B'))
+    h.update(extra.encode('utf-8'))
+    return h.hexdigest()
+
+
+def hash_file(filepath, chunk_size=1 << 24):
+    h = hashlib.blake2b(digest_size=16)
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+# linux FICLONE ioctl, shares extents on btrfs/xfs
+FICLONE = 0x40049409
+
+def reflink_file(srcfile, dstfile):
+    import fcntl
+    with open(srcfile, 'rb') as src, open(dstfile, 'wb') as dst:
+        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+
+
+def transfer_file(srcfile, dstfile, mode='COPY'):
+    '''Copy or link srcfile to dstfile, returns False when they already are the same file'''
+    # an image can live in the export folder already, never delete it from under itself
+    if os.path.exists(dstfile) and os.path.samefile(srcfile, dstfile):
+        return False
+    # written under a temp name and renamed, a reader of the old file never sees a partial one
+    tmpfile = dstfile + '.tmp%d' % os.getpid()
+    if os.path.lexists(tmpfile):
+        os.remove(tmpfile)
+    try:
+        if mode == 'HARDLINK':
+            os.link(srcfile, tmpfile)
+        elif mode == 'REFLINK':
+            reflink_file(srcfile, tmpfile)
+        else:
+            shutil.copyfile(srcfile, tmpfile)
+    except (OSError, ImportError) as e:
+        if mode == 'COPY':
+            raise
+        print('[warning] %s failed, falling back to copy:' % mode.lower(), e)
+        if os.path.lexists(tmpfile):
+            os.remove(tmpfile)
+        shutil.copyfile(srcfile, tmpfile)
+    os.replace(tmpfile, dstfile)
+    return True
+
+
+def modifier_state(object):
+    state = []
+    for m in object.modifiers:
+        state.append('%s:%s:%d:%d' % (m.name, m.type, m.show_viewport, m.show_render))
+    return ';'.join(state)
+
+
+def hash_mesh(data, state=''):
+    return hash_arrays([data.positions, data.normals, data.uvs, data.indices, data.material_indices],
+                       state)
+
+
+class ExportCache:
+    '''Persistent manifest of files written to an export folder'''
+    def __init__(self, export_dir):
+        self.filepath = os.path.join(export_dir, CACHE_FILENAME)
+        self.export_dir = export_dir
+        self.meshes = {}
+        self.textures = {}
+        self.sources = {}
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.filepath):
+            return
+        try:
+            with open(self.filepath, 'r') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            print('[warning] ignoring unreadable export cache', self.filepath)
+            return
+        if manifest.get('version') != CACHE_VERSION:
+            return
+        self.meshes = manifest.get('meshes', {})
+        self.textures = manifest.get('textures', {})
+        self.sources = manifest.get('sources', {})
+
+    def save(self):
+        manifest = {
+            'version': CACHE_VERSION,
+            'meshes': self.meshes,
+            'textures': self.textures,
+            'sources': self.sources,
+        }
+        with open(self.filepath, 'w') as f:
+            json.dump(manifest, f)
+
+    def is_current(self, entries, key, digest):
+        entry = entries.get(key)
+        if entry is None or entry['hash'] != digest:
+            return False
+        path = os.path.join(self.export_dir, key)
+        return os.path.exists(path) and os.path.getsize(path) == entry['size']
+
+    def update(self, entries, key, digest):
+        path = os.path.join(self.export_dir, key)
+        entries[key] = {
+            'hash': digest,
+            'size': os.path.getsize(path),
+        }
+
+    def is_mesh_current(self, fn, digest):
+        return self.is_current(self.meshes, fn, digest)
+
+    def update_mesh(self, fn, digest, stats=None):
+        self.update(self.meshes, fn, digest)
+        if stats is not None:
+            self.meshes[fn]['stats'] = stats
+
+    def mesh_stats(self, fn):
+        entry = self.meshes.get(fn)
+        return None if entry is None else entry.get('stats')
+
+    def is_file_current(self, srcfile, fn, use_hash=False):
+        entry = self.textures.get(fn)
+        dstfile = os.path.join(self.export_dir, fn)
+        if entry is None or entry['src'] != srcfile or not os.path.exists(dstfile):
+            return False
+        st = os.stat(srcfile)
+        if st.st_size != entry['size'] or os.path.getsize(dstfile) != entry['size']:
+            return False
+        if st.st_mtime_ns == entry['mtime']:
+            return True
+        # touched but maybe not modified, the content hash decides
+        if use_hash and entry.get('hash') == hash_file(srcfile):
+            entry['mtime'] = st.st_mtime_ns
+            return True
+        return False
+
+    def update_file(self, srcfile, fn, use_hash=False):
+        st = os.stat(srcfile)
+        self.textures[fn] = {
+            'src': srcfile,
+            'size': st.st_size,
+            'mtime': st.st_mtime_ns,
+            'hash': hash_file(srcfile) if use_hash else None,
+        }
+
+    def source_hash(self, srcfile):
+        # content hash of a source file, only recomputed when its size or mtime changed
+        st = os.stat(srcfile)
+        entry = self.sources.get(srcfile)
+        if entry is not None and entry['size'] == st.st_size and entry['mtime'] == st.st_mtime_ns:
+            return entry['hash']
+        digest = hash_file(srcfile)
+        self.sources[srcfile] = {
+            'size': st.st_size,
+            'mtime': st.st_mtime_ns,
+            'hash': digest,
+        }
+        return digest
+
+
+def publish_file(srcfile, dstfile, fn, cache=None, mode='COPY', use_hash=False):
+    '''Copy or link srcfile into the export folder unless the manifest says it is already there'''
+    if cache is not None and cache.is_file_current(srcfile, fn, use_hash):
+        print('file unchanged, skip copying:', fn)
+        return False
+    dst_dir = os.path.dirname(dstfile)
+    if not os.path.exists(dst_dir):
+        os.makedirs(dst_dir)
+    copied = transfer_file(srcfile, dstfile, mode)
+    if cache is not None:
+        cache.update_file(srcfile, fn, use_hash)
+    return copied
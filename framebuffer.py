@@ -0,0 +1,99 @@
+import mmap
+import struct
+
+import numpy as np
+
+
+# A progressive framebuffer shared with the renderer process through a file.
+#
+# 64 byte header followed by width * height * 4 little-endian float32 RGBA
+# pixels, rows stored bottom to top like blender's render result. The renderer
+# writes pixels in place, then publishes: sequence is bumped to an odd value,
+# the region it touched, samples and done are filled in, and sequence is bumped
+# again to an even value. A reader that saw sequence go up by exactly 2 and
+# unchanged around reading the region knows it got one consistent update.
+
+MAGIC = b'LMFB'
+VERSION = 1
+HEADER = struct.Struct('<4s11I')
+HEADER_SIZE = 64
+CHANNELS = 4
+
+# field offsets into the header, after magic
+_VERSION, _WIDTH, _HEIGHT, _CHANNELS, _SEQUENCE, _SAMPLES, _DONE, _X, _Y, _W, _H = range(11)
+
+
+def create(filepath, width, height):
+    '''Allocate a zeroed framebuffer file, sized so the renderer never has to grow it'''
+    size = HEADER_SIZE + width * height * CHANNELS * 4
+    with open(filepath, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, width, height, CHANNELS, 0, 0, 0, 0, 0, 0, 0))
+        f.truncate(size)
+    return filepath
+
+
+class MappedFramebuffer:
+    '''Memory mapped view of a framebuffer file, used by both sides'''
+    def __init__(self, filepath, write=False):
+        self.filepath = filepath
+        self.file = open(filepath, 'r+b' if write else 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_WRITE if write else mmap.ACCESS_READ)
+        header = HEADER.unpack_from(self.map, 0)
+        if header[0] != MAGIC:
+            self.close()
+            raise ValueError('%s is not a luminous framebuffer' % filepath)
+        self.width = header[1 + _WIDTH]
+        self.height = header[1 + _HEIGHT]
+        self.channels = header[1 + _CHANNELS]
+        # no copy, reads always see what the renderer wrote last
+        self.pixels = np.frombuffer(self.map, dtype='<f4', count=self.width * self.height * self.channels,
+                                    offset=HEADER_SIZE).reshape(self.height, self.width, self.channels)
+        if not write:
+            self.pixels.flags.writeable = False
+
+    def field(self, index):
+        return struct.unpack_from('<I', self.map, 4 + index * 4)[0]
+
+    def set_field(self, index, value):
+        struct.pack_into('<I', self.map, 4 + index * 4, value)
+
+    @property
+    def sequence(self):
+        return self.field(_SEQUENCE)
+
+    @property
+    def samples(self):
+        return self.field(_SAMPLES)
+
+    @property
+    def done(self):
+        return bool(self.field(_DONE))
+
+    def region(self):
+        # (x, y, w, h) touched by the last update, the whole frame if unset
+        x, y, w, h = (self.field(i) for i in (_X, _Y, _W, _H))
+        if w == 0 or h == 0:
+            return 0, 0, self.width, self.height
+        return x, y, w, h
+
+    def publish(self, samples, region=None, done=False):
+        # renderer side, call after the pixels of region are written
+        sequence = self.sequence
+        self.set_field(_SEQUENCE, sequence + 1)
+        x, y, w, h = region if region is not None else (0, 0, 0, 0)
+        for index, value in ((_X, x), (_Y, y), (_W, w), (_H, h), (_SAMPLES, samples)):
+            self.set_field(index, value)
+        if done:
+            self.set_field(_DONE, 1)
+        self.set_field(_SEQUENCE, sequence + 2)
+
+    def close(self):
+        self.pixels = None
+        self.map.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
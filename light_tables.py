@@ -0,0 +1,227 @@
+import os
+import struct
+
+import numpy as np
+
+from . import morton
+from . import envmap_sampling
+
+
+# Light sampling tables the renderer would otherwise build at startup.
+#
+# light_sampler.bin, little-endian, arrays 16 byte aligned:
+#   header  '4s5I'  magic, version, num_lights, num_nodes, root, num_infinite
+#   lights  LIGHT_DTYPE [num_lights]  bounds, emitted power and orientation cone
+#   pmf     float32 [num_lights]      power proportional probabilities
+#   prob    float32 [num_lights]      alias table acceptance probabilities
+#   alias   uint32  [num_lights]      alias table fallbacks
+#   nodes   NODE_DTYPE [num_nodes]    light bvh, leaves first, root last
+#
+# kind/index point back at the scene: kind 0 is lights[index] (point lights),
+# kind 1 is shapes[index] (emissive quads), kind 2 is lights[index] (the
+# environment map). Cones are stored as cosines like pbrt's LightBounds:
+# theta_o bounds the normals, theta_e the emission spread.
+#
+# Infinite lights are the last num_infinite records. They take part in the
+# power distribution but not in the bvh, which only covers the bounded ones, so
+# like pbrt's BVHLightSampler the renderer picks them separately. Their power
+# is pbrt's pi * 4 pi r^2 * average radiance, r the radius of the scene bounds.
+
+MAGIC = b'LMLS'
+VERSION = 2
+HEADER = struct.Struct('<4s5I')
+ALIGNMENT = 16
+
+KIND_LIGHT = 0
+KIND_SHAPE = 1
+KIND_ENVMAP = 2
+
+LIGHT_DTYPE = np.dtype([
+    ('kind', '<u4'),
+    ('index', '<u4'),
+    ('bounds_min', '<f4', 3),
+    ('bounds_max', '<f4', 3),
+    ('axis', '<f4', 3),
+    ('cos_theta_o', '<f4'),
+    ('cos_theta_e', '<f4'),
+    ('phi', '<f4'),
+])
+
+NODE_DTYPE = np.dtype([
+    ('bounds_min', '<f4', 3),
+    ('bounds_max', '<f4', 3),
+    ('axis', '<f4', 3),
+    ('cos_theta_o', '<f4'),
+    ('cos_theta_e', '<f4'),
+    ('phi', '<f4'),
+    ('child0', '<i4'),
+    ('child1', '<i4'),
+    ('light', '<i4'),
+])
+
+def luminance(color):
+    return float(envmap_sampling.luminance(np.asarray(color[:3], dtype=np.float64)))
+
+
+class LightTable:
+    '''Per light bounds and power gathered while the lights are exported'''
+    def __init__(self):
+        self.records = []
+        # (index, average radiance) of the environment maps
+        self.infinite = []
+        # world bounds of the scene geometry, for the power of infinite lights
+        self.scene_bounds = None
+
+    def add_point(self, index, position, color):
+        # isotropic, the cone covers the whole sphere
+        p = np.asarray(position, dtype=np.float64)
+        self.records.append((KIND_LIGHT, index, p, p, (0.0, 0.0, 1.0), -1.0, 0.0,
+                             4 * np.pi * luminance(color)))
+
+    def add_quad(self, index, corners, normal, area, color, scale):
+        # one sided emitter, cosine falloff up to the tangent plane
+        corners = np.asarray(corners, dtype=np.float64)
+        self.records.append((KIND_SHAPE, index, corners.min(axis=0), corners.max(axis=0), normal, 1.0, 0.0,
+                             np.pi * area * scale * luminance(color)))
+
+    def add_envmap(self, index, radiance):
+        self.infinite.append((index, radiance))
+
+    def add_bounds(self, bounds):
+        lo, hi = np.asarray(bounds, dtype=np.float64)
+        if self.scene_bounds is not None:
+            lo = np.minimum(lo, self.scene_bounds[0])
+            hi = np.maximum(hi, self.scene_bounds[1])
+        self.scene_bounds = (lo, hi)
+
+    def __len__(self):
+        return len(self.records) + len(self.infinite)
+
+    def bounds(self):
+        # scene geometry and the bounded lights, None when both are empty
+        boxes = [(r[2], r[3]) for r in self.records]
+        if self.scene_bounds is not None:
+            boxes.append(self.scene_bounds)
+        if not boxes:
+            return None
+        return np.min([b[0] for b in boxes], axis=0), np.max([b[1] for b in boxes], axis=0)
+
+    def lights(self):
+        records = list(self.records)
+        if self.infinite:
+            bounds = self.bounds()
+            lo, hi = bounds if bounds is not None else (np.zeros(3), np.zeros(3))
+            radius = 0.5 * np.linalg.norm(hi - lo)
+            for index, radiance in self.infinite:
+                records.append((KIND_ENVMAP, index, lo, hi, (0.0, 0.0, 1.0), -1.0, 0.0,
+                                np.pi * 4 * np.pi * radius * radius * radiance))
+        lights = np.zeros(len(records), dtype=LIGHT_DTYPE)
+        for i, field in enumerate(LIGHT_DTYPE.names):
+            lights[field] = [r[i] for r in records]
+        return lights
+
+
+def alias_table(weights):
+    '''Vose's alias method, returns (pmf, prob, alias)'''
+    n = len(weights)
+    total = float(np.sum(weights))
+    if n == 0:
+        return np.empty(0, np.float32), np.empty(0, np.float32), np.empty(0, np.uint32)
+    pmf = np.asarray(weights, dtype=np.float64) / total if total > 0 else np.full(n, 1.0 / n)
+    scaled = pmf * n
+    prob = np.ones(n)
+    alias = np.arange(n, dtype=np.uint32)
+    small = list(np.flatnonzero(scaled < 1))
+    large = list(np.flatnonzero(scaled >= 1))
+    while small and large:
+        s = small.pop()
+        l = large.pop()
+        prob[s] = scaled[s]
+        alias[s] = l
+        scaled[l] -= 1 - scaled[s]
+        (small if scaled[l] < 1 else large).append(l)
+    # leftovers are 1 up to rounding
+    return pmf.astype(np.float32), prob.astype(np.float32), alias
+
+
+def merge_cones(axis0, theta0, axis1, theta1):
+    # conservative union of two cones, vectorized over node pairs
+    axis = axis0 + axis1
+    length = np.linalg.norm(axis, axis=1, keepdims=True)
+    degenerate = length[:, 0] < 1e-8
+    axis = np.where(degenerate[:, None], axis0, axis / np.maximum(length, 1e-8))
+    angle0 = np.arccos(np.clip(np.sum(axis * axis0, axis=1), -1, 1))
+    angle1 = np.arccos(np.clip(np.sum(axis * axis1, axis=1), -1, 1))
+    theta = np.minimum(np.maximum(angle0 + theta0, angle1 + theta1), np.pi)
+    theta = np.where(degenerate, np.pi, theta)
+    return axis, theta
+
+
+def build_bvh(lights):
+    '''Binary light bvh over morton ordered lights, see morton.build_bottom_up
+
+    Leaves index into lights, so the bounded lights have to come first.
+    '''
+    n = len(lights)
+    if n == 0:
+        return np.empty(0, dtype=NODE_DTYPE), 0
+    centroids = 0.5 * (lights['bounds_min'] + lights['bounds_max']).astype(np.float64)
+    order = morton.morton_order(centroids)
+    nodes = np.zeros(2 * n - 1, dtype=NODE_DTYPE)
+    leaves = nodes[:n]
+    for field in ('bounds_min', 'bounds_max', 'axis', 'cos_theta_o', 'cos_theta_e', 'phi'):
+        leaves[field] = lights[field][order]
+    leaves['child0'] = -1
+    leaves['child1'] = -1
+    leaves['light'] = order
+    return nodes, morton.build_bottom_up(nodes, n, merge_nodes)
+
+
+def merge_nodes(nodes, left, right, parents):
+    a = nodes[left]
+    b = nodes[right]
+    p = nodes[parents]
+    p['bounds_min'] = np.minimum(a['bounds_min'], b['bounds_min'])
+    p['bounds_max'] = np.maximum(a['bounds_max'], b['bounds_max'])
+    axis, theta_o = merge_cones(a['axis'].astype(np.float64), np.arccos(np.clip(a['cos_theta_o'], -1, 1)),
+                                b['axis'].astype(np.float64), np.arccos(np.clip(b['cos_theta_o'], -1, 1)))
+    p['axis'] = axis
+    p['cos_theta_o'] = np.cos(theta_o)
+    p['cos_theta_e'] = np.minimum(a['cos_theta_e'], b['cos_theta_e'])
+    p['phi'] = a['phi'] + b['phi']
+    p['child0'] = left
+    p['child1'] = right
+    p['light'] = -1
+    nodes[parents] = p
+
+
+def write_tables(filepath, table, bvh=True):
+    lights = table.lights()
+    bounded = len(lights) - len(table.infinite)
+    pmf, prob, alias = alias_table(lights['phi'])
+    nodes, root = build_bvh(lights[:bounded]) if bvh else (np.empty(0, dtype=NODE_DTYPE), 0)
+    tmpfile = filepath + '.tmp'
+    with open(tmpfile, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(lights), len(nodes), root, len(table.infinite)))
+        for array in (lights, pmf, prob, alias, nodes):
+            f.write(b'\0' * (-f.tell() % ALIGNMENT))
+            array.tofile(f)
+        nbytes = f.tell()
+    os.replace(tmpfile, filepath)
+    return nbytes
+
+
+def read_tables(filepath):
+    data = np.memmap(filepath, dtype=np.uint8, mode='r')
+    magic, version, num_lights, num_nodes, root, num_infinite = HEADER.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise ValueError('%s is not a light sampler table' % filepath)
+    tables = {'root': root, 'num_infinite': num_infinite}
+    offset = HEADER.size
+    for key, dtype, count in (('lights', LIGHT_DTYPE, num_lights), ('pmf', np.dtype('<f4'), num_lights),
+                              ('prob', np.dtype('<f4'), num_lights), ('alias', np.dtype('<u4'), num_lights),
+                              ('nodes', NODE_DTYPE, num_nodes)):
+        offset += -offset % ALIGNMENT
+        tables[key] = np.frombuffer(data, dtype=dtype, count=count, offset=offset)
+        offset += dtype.itemsize * count
+    return tables
@@ -0,0 +1,307 @@
+import bpy
+import time
+import traceback
+
+from importlib import reload
+
+if __name__ == "__main__":
+    from blender2luminous import render_exporter
+    from blender2luminous import scene_builder
+    from blender2luminous import export_cache
+    from blender2luminous import light_tables
+    from blender2luminous import profiler
+    reload(render_exporter)
+    reload(scene_builder)
+    reload(export_cache)
+    reload(light_tables)
+    reload(profiler)
+else:
+    from . import render_exporter
+    from . import scene_builder
+    from . import export_cache
+    from . import light_tables
+    from . import profiler
+
+
+class LiveSync:
+    '''Collects depsgraph updates and re-exports only what changed, debounced
+
+    The scene builder of the last full export is kept, moved or edited meshes,
+    lights and the camera are patched into it and only their files, the light
+    tables, the instance bvh and scene.json are rewritten. Material, world and
+    scene setting changes, added or removed objects and anything the patch
+    can't place fall back to a full export.
+    '''
+    def __init__(self, scene, delay=0.5):
+        self.scene_name = scene.name
+        self.delay = delay
+        self.scene_json = None
+        # shape name -> index in scene_json.shapes
+        self.shape_index = {}
+        self.dirty_geometry = set()
+        self.dirty_meshes = set()
+        self.dirty_transforms = set()
+        self.dirty_lights = False
+        self.dirty_camera = False
+        self.dirty_full = False
+        self.last_update = 0.0
+        self.syncing = False
+
+    def scene(self):
+        return bpy.data.scenes.get(self.scene_name)
+
+    def is_dirty(self):
+        return bool(self.dirty_geometry or self.dirty_meshes or self.dirty_transforms
+                    or self.dirty_lights or self.dirty_camera or self.dirty_full)
+
+    def collect(self, depsgraph):
+        for update in depsgraph.updates:
+            id = update.id
+            name = getattr(id, 'original', id).name
+            if isinstance(id, bpy.types.Object):
+                if id.type == 'LIGHT':
+                    self.dirty_lights = True
+                elif id.type == 'CAMERA':
+                    self.dirty_camera = True
+                elif update.is_updated_geometry:
+                    self.dirty_geometry.add(name)
+                elif update.is_updated_transform:
+                    self.dirty_transforms.add(name)
+            elif isinstance(id, bpy.types.Mesh):
+                # edit mode changes arrive on the mesh data, instances are written under its name
+                self.dirty_meshes.add(name)
+            elif isinstance(id, bpy.types.Light):
+                self.dirty_lights = True
+            elif isinstance(id, bpy.types.Camera):
+                self.dirty_camera = True
+            elif isinstance(id, (bpy.types.Material, bpy.types.ShaderNodeTree, bpy.types.Image,
+                                 bpy.types.Scene, bpy.types.Collection, bpy.types.World)):
+                self.dirty_full = True
+        if self.is_dirty():
+            self.last_update = time.monotonic()
+
+    def clear(self):
+        self.dirty_geometry = set()
+        self.dirty_meshes = set()
+        self.dirty_transforms = set()
+        self.dirty_lights = False
+        self.dirty_camera = False
+        self.dirty_full = False
+
+    def export(self, scene, dirty=None):
+        # entries stay in memory so later passes can patch them
+        self.scene_json = render_exporter.export_luminous(bpy.path.abspath(scene.exportpath), scene,
+                                                          streaming=False, dirty=dirty)
+        self.shape_index = {shape.get('name'): i for i, shape in enumerate(self.scene_json.shapes)}
+
+    def patch_meshes(self, scene, depsgraph, geometry, transforms, cache):
+        scene_json = self.scene_json
+        names = sorted(geometry | transforms)
+        objects = render_exporter.find_export_objects(depsgraph, names=names)
+        for name, object in zip(names, objects):
+            index = self.shape_index.get(name)
+            if object is None or object.type != 'MESH' or index is None or name + '_instance_0' in self.shape_index:
+                return False
+            # shared datablocks are written once for all their users
+            if name in geometry and scene_json.shapes[index]['param']['fn'].startswith('meshes/instances/'):
+                return False
+
+        materials = render_exporter.MaterialCompiler(scene, scene_json, cache)
+        for name, object in zip(names, objects):
+            index = self.shape_index[name]
+            fn = scene_json.shapes[index]['param']['fn']
+            if name in geometry:
+                render_exporter.write_mesh(scene, object, fn, cache)
+            slot_names = [materials.compile(object, slot) for slot in range(len(object.material_slots))]
+            patch = scene_builder.SceneBuilder(precision=render_exporter.matrix_precision(scene))
+            render_exporter.export_mesh(scene, patch, object, slot_names[0] if slot_names else "", index,
+                                        cache, fn, slot_names=slot_names)
+            shape = patch.shapes[0]
+            scene_json.shapes[index] = shape
+            if scene_json.instance_bounds is not None and 'bounds' in shape['param']:
+                scene_json.instance_bounds.update(index, shape['param']['bounds']['world'])
+        if scene_json.instance_bounds is not None:
+            render_exporter.export_instance_bvh(scene, scene_json)
+        table = scene_json.light_table
+        if table is not None and table.infinite:
+            # the power of the environment map follows the scene bounds
+            table.scene_bounds = None
+            for shape in scene_json.shapes:
+                if 'bounds' in shape['param']:
+                    table.add_bounds(shape['param']['bounds']['world'])
+            render_exporter.export_light_sampler(scene, scene_json)
+        return True
+
+    def patch_lights(self, scene, depsgraph):
+        scene_json = self.scene_json
+        lights = render_exporter.find_export_objects(depsgraph, type='LIGHT')
+        patch = scene_builder.SceneBuilder(precision=render_exporter.matrix_precision(scene))
+        if scene_json.light_table is not None:
+            patch.light_table = light_tables.LightTable()
+        render_exporter.export_point_lights(scene, patch, lights)
+        render_exporter.export_area_lights(scene, patch, lights)
+
+        # point lights have no name, they keep their slots in order
+        points = [i for i, light in enumerate(scene_json.lights) if light['type'] == 'PointLight']
+        quads = [self.shape_index.get(shape['name']) for shape in patch.shapes]
+        num_quads = sum(1 for shape in scene_json.shapes if shape['type'] == 'quad')
+        if len(points) != len(patch.lights) or None in quads or len(quads) != num_quads:
+            return False
+        for i, light in zip(points, patch.lights):
+            scene_json.lights[i] = light
+        for i, shape in zip(quads, patch.shapes):
+            scene_json.shapes[i] = shape
+        if patch.light_table is not None:
+            # the table was built against the patch, point it at the scene's slots,
+            # the environment map and the scene bounds are kept
+            slots = {light_tables.KIND_LIGHT: points, light_tables.KIND_SHAPE: quads}
+            scene_json.light_table.records = [(kind, slots[kind][index]) + tuple(rest)
+                                              for kind, index, *rest in patch.light_table.records]
+        render_exporter.export_light_sampler(scene, scene_json)
+        return True
+
+    def patch(self, scene, geometry, meshes, transforms, lights, camera):
+        '''Patch the last export in place, False when a full export is needed'''
+        if self.scene_json is None:
+            return False
+        # a mesh datablock shared by several objects changed under all of them, the
+        # edits of other meshes also arrive as geometry updates of their object
+        if meshes:
+            fns = {shape['param'].get('fn') for shape in self.scene_json.shapes}
+            if any('meshes/instances/' + name + scene.file_format in fns for name in meshes):
+                return False
+        filepath = bpy.path.abspath(scene.exportpath)
+        with profiler.session(filepath, scene.write_export_trace):
+            depsgraph = render_exporter.evaluated_depsgraph(scene)
+            cache = None
+            if scene.use_export_cache:
+                cache = export_cache.ExportCache(filepath)
+            if (geometry or transforms) and not self.patch_meshes(scene, depsgraph, geometry, transforms, cache):
+                return False
+            if lights and not self.patch_lights(scene, depsgraph):
+                return False
+            if camera:
+                render_exporter.export_camera(scene, self.scene_json,
+                                              render_exporter.find_export_objects(depsgraph, type='CAMERA'))
+            with profiler.stage('export_scene', len(self.scene_json.shapes) + len(self.scene_json.lights)):
+                self.scene_json.write(bpy.path.abspath(filepath + '/scene.json'))
+            if cache is not None:
+                cache.save()
+        return True
+
+    def flush(self):
+        scene = self.scene()
+        if scene is None or not self.is_dirty():
+            self.clear()
+            return
+        geometry = self.dirty_geometry
+        changes = (geometry, self.dirty_meshes, self.dirty_transforms, self.dirty_lights, self.dirty_camera)
+        full = self.dirty_full
+        print("Live export: %d meshes, %d transforms changed%s%s%s" % (
+            len(geometry), len(self.dirty_transforms), ', lights' if self.dirty_lights else '',
+            ', camera' if self.dirty_camera else '', ', full export' if full else ''))
+        self.clear()
+        self.syncing = True
+        try:
+            if full or not self.patch(scene, *changes):
+                self.export(scene, geometry | changes[1])
+        except Exception:
+            # the kept entries may be half patched, start over next time
+            self.scene_json = None
+            raise
+        finally:
+            self.syncing = False
+
+    def tick(self):
+        # timer callback, returns seconds until it wants to run again
+        if not self.is_dirty():
+            return self.delay
+        remaining = self.last_update + self.delay - time.monotonic()
+        if remaining > 0:
+            return remaining
+        self.flush()
+        return self.delay
+
+
+active = None
+
+
+@bpy.app.handlers.persistent
+def on_depsgraph_update(scene, depsgraph=None):
+    if active is None or active.syncing or scene.name != active.scene_name:
+        return
+    if depsgraph is None:
+        depsgraph = bpy.context.evaluated_depsgraph_get()
+    active.collect(depsgraph)
+
+
+def on_timer():
+    if active is None:
+        return None
+    # an exception would unregister the timer and silently end the sync
+    try:
+        return active.tick()
+    except Exception:
+        print("Live export failed:")
+        traceback.print_exc()
+        return active.delay if active is not None else None
+
+
+@bpy.app.handlers.persistent
+def on_load_post(*args):
+    # timers and the sync state don't survive loading a file, the saved flag does
+    stop()
+    for scene in bpy.data.scenes:
+        if getattr(scene, 'live_export', False):
+            try:
+                start(scene)
+            except Exception:
+                print("Live export failed to start for %s:" % scene.name)
+                traceback.print_exc()
+                stop()
+            break
+
+
+def start(scene):
+    global active
+    stop()
+    active = LiveSync(scene, scene.live_export_delay)
+    # one full pass so every file exists, later passes only touch what changed
+    active.export(scene)
+    if on_depsgraph_update not in bpy.app.handlers.depsgraph_update_post:
+        bpy.app.handlers.depsgraph_update_post.append(on_depsgraph_update)
+    if not bpy.app.timers.is_registered(on_timer):
+        bpy.app.timers.register(on_timer, first_interval=active.delay)
+
+
+def stop():
+    global active
+    active = None
+    if on_depsgraph_update in bpy.app.handlers.depsgraph_update_post:
+        bpy.app.handlers.depsgraph_update_post.remove(on_depsgraph_update)
+    if bpy.app.timers.is_registered(on_timer):
+        bpy.app.timers.unregister(on_timer)
+
+
+def update_live_export(self, context):
+    # bpy property update callback, self is the scene
+    if self.live_export:
+        start(self)
+    elif active is not None and active.scene_name == self.name:
+        stop()
+
+
+def update_live_export_delay(self, context):
+    if active is not None and active.scene_name == self.name:
+        active.delay = self.live_export_delay
+
+
+def register():
+    if on_load_post not in bpy.app.handlers.load_post:
+        bpy.app.handlers.load_post.append(on_load_post)
+
+
+def unregister():
+    stop()
+    if on_load_post in bpy.app.handlers.load_post:
+        bpy.app.handlers.load_post.remove(on_load_post)
@@ -0,0 +1,434 @@
+import os
+import struct
+
+import numpy as np
+
+from . import morton
+
+
+# binary little-endian PLY face record: "property list uchar uint vertex_indices"
+PLY_FACE_DTYPE = np.dtype([('count', 'u1'), ('indices', '<u4', (3,))])
+
+
+class MeshData:
+    '''Loop-level mesh buffers pulled out of a blender mesh with foreach_get'''
+    def __init__(self, positions, normals, uvs, indices, material_indices=None):
+        self.positions = positions
+        self.normals = normals
+        self.uvs = uvs
+        self.indices = indices
+        self.material_indices = material_indices
+
+    @property
+    def num_vertices(self):
+        return len(self.positions)
+
+    @property
+    def num_triangles(self):
+        return len(self.indices)
+
+    @property
+    def nbytes(self):
+        arrays = [self.positions, self.normals, self.uvs, self.indices, self.material_indices]
+        return sum(a.nbytes for a in arrays if a is not None)
+
+
+def mesh_to_arrays(mesh):
+    # expects loop triangles and split normals to be calculated already
+    num_verts = len(mesh.vertices)
+    num_loops = len(mesh.loops)
+    num_tris = len(mesh.loop_triangles)
+
+    co = np.empty(num_verts * 3, dtype=np.float32)
+    mesh.vertices.foreach_get("co", co)
+
+    vertex_index = np.empty(num_loops, dtype=np.int32)
+    mesh.loops.foreach_get("vertex_index", vertex_index)
+    positions = co.reshape(-1, 3)[vertex_index]
+
+    normals = np.empty(num_loops * 3, dtype=np.float32)
+    mesh.loops.foreach_get("normal", normals)
+
+    uvs = None
+    uv_layer = mesh.uv_layers.active
+    if uv_layer is not None:
+        uvs = np.empty(num_loops * 2, dtype=np.float32)
+        uv_layer.data.foreach_get("uv", uvs)
+        uvs = uvs.reshape(-1, 2)
+
+    # foreach_get only accepts signed ints, the view keeps it zero copy
+    indices = np.empty(num_tris * 3, dtype=np.int32)
+    mesh.loop_triangles.foreach_get("loops", indices)
+
+    material_indices = np.empty(num_tris, dtype=np.int32)
+    mesh.loop_triangles.foreach_get("material_index", material_indices)
+
+    return MeshData(positions,
+                    normals.reshape(-1, 3),
+                    uvs,
+                    indices.view(np.uint32).reshape(-1, 3),
+                    material_indices)
+
+
+def sort_by_material(data):
+    '''Group triangles by material index with one stable sort, vertices stay shared'''
+    m = data.material_indices
+    if m is None or len(m) == 0 or np.all(m == m[0]):
+        return data
+    order = np.argsort(m, kind='stable')
+    return MeshData(data.positions, data.normals, data.uvs, data.indices[order], m[order])
+
+
+def material_ranges(material_indices):
+    # [[material index, first triangle, triangle count], ...] of a sorted mesh
+    if material_indices is None or len(material_indices) == 0:
+        return []
+    slots, first, counts = np.unique(material_indices, return_index=True, return_counts=True)
+    return [[int(s), int(f), int(c)] for s, f, c in zip(slots, first, counts)]
+
+
+def mesh_stats(data):
+    '''Object space bounds, counts and material ranges of the mesh as written, for the shape entry'''
+    if data.num_vertices == 0:
+        bounds = [[0.0, 0.0, 0.0], [0.0, 0.0, 0.0]]
+    else:
+        bounds = [data.positions.min(axis=0).tolist(), data.positions.max(axis=0).tolist()]
+    return {
+        'bounds': bounds,
+        'num_triangles': data.num_triangles,
+        'num_vertices': data.num_vertices,
+        'material_ranges': material_ranges(data.material_indices),
+    }
+
+
+def weld_vertices(data):
+    '''Merge loop vertices whose position, normal and uv are bitwise identical'''
+    if data.num_vertices == 0:
+        return data
+    columns = [data.positions]
+    if data.normals is not None:
+        columns.append(data.normals)
+    if data.uvs is not None:
+        columns.append(data.uvs)
+    rows = np.ascontiguousarray(np.hstack(columns), dtype=np.float32)
+    # one opaque item per row so unique compares whole tuples
+    keys = rows.view(np.dtype((np.void, rows.dtype.itemsize * rows.shape[1]))).ravel()
+    _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    if len(first) == data.num_vertices:
+        return data
+    # keep the vertices in their original order
+    order = np.argsort(first, kind='stable')
+    remap = np.empty(len(first), dtype=np.uint32)
+    remap[order] = np.arange(len(first), dtype=np.uint32)
+    keep = first[order]
+    return MeshData(data.positions[keep],
+                    None if data.normals is None else data.normals[keep],
+                    None if data.uvs is None else data.uvs[keep],
+                    remap[inverse.ravel()][data.indices],
+                    data.material_indices)
+
+
+def ply_header(num_vertices, num_faces, has_normals, has_uvs):
+    lines = [
+        "ply",
+        "format binary_little_endian 1.0",
+        "comment Created by blender2luminous",
+        "element vertex %d" % num_vertices,
+        "property float x",
+        "property float y",
+        "property float z",
+    ]
+    if has_normals:
+        lines += ["property float nx", "property float ny", "property float nz"]
+    if has_uvs:
+        lines += ["property float s", "property float t"]
+    lines += [
+        "element face %d" % num_faces,
+        "property list uchar uint vertex_indices",
+        "end_header",
+    ]
+    return ("\n".join(lines) + "\n").encode("ascii")
+
+
+def ply_vertex_buffer(data, start=0, stop=None):
+    columns = [data.positions[start:stop]]
+    if data.normals is not None:
+        columns.append(data.normals[start:stop])
+    if data.uvs is not None:
+        columns.append(data.uvs[start:stop])
+    return np.ascontiguousarray(np.hstack(columns), dtype='<f4')
+
+
+def ply_face_buffer(indices):
+    faces = np.empty(len(indices), dtype=PLY_FACE_DTYPE)
+    faces['count'] = 3
+    faces['indices'] = indices
+    return faces
+
+
+def write_ply(filepath, data, chunk_bytes=0):
+    # with chunk_bytes the interleaved buffers are built and written a slice at a
+    # time, so a huge mesh never needs a second full copy of itself in memory
+    header = ply_header(data.num_vertices, data.num_triangles,
+                        data.normals is not None, data.uvs is not None)
+    nbytes = len(header)
+    if chunk_bytes > 0:
+        vertex_size = 4 * (3 + 3 * (data.normals is not None) + 2 * (data.uvs is not None))
+        vertex_step = max(chunk_bytes // vertex_size, 1)
+        face_step = max(chunk_bytes // PLY_FACE_DTYPE.itemsize, 1)
+    else:
+        vertex_step = max(data.num_vertices, 1)
+        face_step = max(data.num_triangles, 1)
+    with open(filepath, 'wb') as f:
+        f.write(header)
+        for start in range(0, data.num_vertices, vertex_step):
+            vertices = ply_vertex_buffer(data, start, start + vertex_step)
+            vertices.tofile(f)
+            nbytes += vertices.nbytes
+        for start in range(0, data.num_triangles, face_step):
+            faces = ply_face_buffer(data.indices[start:start + face_step])
+            faces.tofile(f)
+            nbytes += faces.nbytes
+    return nbytes
+
+
+# compact encoding
+#################################################
+#
+# positions: uint16 per axis, quantized to the mesh bounds
+#     p = offset + q * scale, offset and scale are in a header comment
+# normals:   octahedral, two snorm16 (value / 32767)
+# uvs:       half floats, declared as ushort since ply has no half type
+#
+# triangles are sorted along a morton curve and vertices renumbered in first
+# use order, so neighbouring triangles share vertices that are close in memory.
+# Meshes written in chunks under a memory budget keep their loop order.
+
+POSITION_BITS = 16
+
+
+def optimize_order(data):
+    '''Reorder triangles for locality and vertices by first use, drops unreferenced vertices'''
+    if data.num_triangles == 0:
+        return data
+    centroids = data.positions[data.indices].mean(axis=1)
+    codes = morton.morton_codes(centroids)
+    if data.material_indices is None:
+        order = np.argsort(codes, kind='stable')
+    else:
+        # material groups stay contiguous, see sort_by_material
+        order = np.lexsort((codes, data.material_indices))
+    indices = data.indices[order]
+
+    flat = indices.ravel()
+    used, first_use = np.unique(flat, return_index=True)
+    vertex_order = used[np.argsort(first_use, kind='stable')]
+    remap = np.empty(data.num_vertices, dtype=np.uint32)
+    remap[vertex_order] = np.arange(len(vertex_order), dtype=np.uint32)
+
+    return MeshData(data.positions[vertex_order],
+                    None if data.normals is None else data.normals[vertex_order],
+                    None if data.uvs is None else data.uvs[vertex_order],
+                    remap[indices],
+                    None if data.material_indices is None else data.material_indices[order])
+
+
+def quantization(positions):
+    # (offset, scale) mapping the bounds of positions onto the uint16 range
+    lo = positions.min(axis=0) if len(positions) else np.zeros(3, dtype=np.float32)
+    hi = positions.max(axis=0) if len(positions) else np.zeros(3, dtype=np.float32)
+    scale = (hi - lo).astype(np.float64) / ((1 << POSITION_BITS) - 1)
+    return lo.astype(np.float64), scale
+
+
+def quantize_positions(positions, offset, scale):
+    steps = (1 << POSITION_BITS) - 1
+    safe = np.where(scale > 0, scale, 1)
+    q = np.rint((positions - offset) / safe)
+    return np.clip(q, 0, steps).astype('<u2')
+
+
+def octahedral_encode(normals):
+    n = normals / np.maximum(np.abs(normals).sum(axis=1, keepdims=True), 1e-20)
+    x, y, z = n[:, 0], n[:, 1], n[:, 2]
+    sign_x = np.where(x >= 0, 1.0, -1.0)
+    sign_y = np.where(y >= 0, 1.0, -1.0)
+    # fold the lower hemisphere over the diagonals
+    ox = np.where(z < 0, (1 - np.abs(y)) * sign_x, x)
+    oy = np.where(z < 0, (1 - np.abs(x)) * sign_y, y)
+    encoded = np.stack([ox, oy], axis=1)
+    return np.rint(np.clip(encoded, -1, 1) * 32767).astype('<i2')
+
+
+def octahedral_decode(encoded):
+    e = encoded.astype(np.float32) / 32767
+    x, y = e[:, 0], e[:, 1]
+    z = 1 - np.abs(x) - np.abs(y)
+    t = np.maximum(-z, 0)
+    x = x - np.where(x >= 0, t, -t)
+    y = y - np.where(y >= 0, t, -t)
+    n = np.stack([x, y, z], axis=1)
+    return n / np.linalg.norm(n, axis=1, keepdims=True)
+
+
+def compact_vertex_dtype(has_normals, has_uvs):
+    fields = [('x', '<u2'), ('y', '<u2'), ('z', '<u2')]
+    if has_normals:
+        fields += [('nx', '<i2'), ('ny', '<i2')]
+    if has_uvs:
+        fields += [('s', '<u2'), ('t', '<u2')]
+    return np.dtype(fields)
+
+
+def compact_ply_header(num_vertices, num_faces, has_normals, has_uvs, offset, scale):
+    lines = [
+        "ply",
+        "format binary_little_endian 1.0",
+        "comment Created by blender2luminous",
+        "comment encoding compact",
+        "comment position_offset %r %r %r" % tuple(float(v) for v in offset),
+        "comment position_scale %r %r %r" % tuple(float(v) for v in scale),
+        "element vertex %d" % num_vertices,
+        "property ushort x",
+        "property ushort y",
+        "property ushort z",
+    ]
+    if has_normals:
+        lines += ["comment normals octahedral_snorm16",
+                  "property short nx", "property short ny"]
+    if has_uvs:
+        lines += ["comment uvs half",
+                  "property ushort s", "property ushort t"]
+    lines += [
+        "element face %d" % num_faces,
+        "property list uchar uint vertex_indices",
+        "end_header",
+    ]
+    return ("\n".join(lines) + "\n").encode("ascii")
+
+
+def write_ply_compact(filepath, data, chunk_bytes=0):
+    # reordering copies every array, with chunk_bytes the mesh is written in its loop order
+    if chunk_bytes <= 0:
+        data = optimize_order(data)
+    has_normals = data.normals is not None
+    has_uvs = data.uvs is not None
+    # bounds are needed before the first vertex
+    offset, scale = quantization(data.positions)
+    header = compact_ply_header(data.num_vertices, data.num_triangles, has_normals, has_uvs, offset, scale)
+    dtype = compact_vertex_dtype(has_normals, has_uvs)
+    nbytes = len(header)
+    vertex_step = max(chunk_bytes // dtype.itemsize, 1) if chunk_bytes > 0 else max(data.num_vertices, 1)
+    face_step = max(chunk_bytes // PLY_FACE_DTYPE.itemsize, 1) if chunk_bytes > 0 else max(data.num_triangles, 1)
+    with open(filepath, 'wb') as f:
+        f.write(header)
+        for start in range(0, data.num_vertices, vertex_step):
+            stop = start + vertex_step
+            positions = quantize_positions(data.positions[start:stop], offset, scale)
+            vertices = np.empty(len(positions), dtype=dtype)
+            vertices['x'], vertices['y'], vertices['z'] = positions.T
+            if has_normals:
+                normals = octahedral_encode(data.normals[start:stop])
+                vertices['nx'], vertices['ny'] = normals.T
+            if has_uvs:
+                uvs = data.uvs[start:stop].astype('<f2').view('<u2')
+                vertices['s'], vertices['t'] = uvs.T
+            vertices.tofile(f)
+            nbytes += vertices.nbytes
+        for start in range(0, data.num_triangles, face_step):
+            faces = ply_face_buffer(data.indices[start:start + face_step])
+            faces.tofile(f)
+            nbytes += faces.nbytes
+    return nbytes
+
+
+# .lmesh container
+#################################################
+#
+# Made to be mmapped and uploaded as is:
+#   header     LMESH_HEADER, 32 bytes: magic, version, num_vertices,
+#              num_triangles, num_attributes, 3 x reserved
+#   attributes LMESH_ATTRIBUTE per array, 32 bytes: attribute id, dtype id,
+#              components, reserved, byte offset, byte size
+#   arrays     one per attribute, non interleaved, each starting on a page
+# Attribute ids and dtypes are listed in LMESH_ATTRIBUTES and LMESH_DTYPES.
+
+LMESH_EXTENSION = '.lmesh'
+LMESH_MAGIC = b'LMSH'
+LMESH_VERSION = 2
+# 32 bytes, so the u64 fields of the attribute records after it are 8 byte aligned
+LMESH_HEADER = struct.Struct('<4s7I')
+LMESH_ATTRIBUTE = struct.Struct('<4IQQ')
+LMESH_PAGE = 4096
+
+LMESH_ATTRIBUTES = ['positions', 'normals', 'uvs', 'indices', 'material_indices']
+LMESH_DTYPES = [np.dtype('<f4'), np.dtype('<u4')]
+
+
+def lmesh_arrays(data):
+    arrays = []
+    for attribute, name in enumerate(LMESH_ATTRIBUTES):
+        array = getattr(data, name)
+        if array is None:
+            continue
+        dtype = LMESH_DTYPES[1] if name in ('indices', 'material_indices') else LMESH_DTYPES[0]
+        # material indices come out of foreach_get as int32, same bits as uint32
+        array = np.ascontiguousarray(array).view(dtype) if array.dtype.itemsize == 4 else array.astype(dtype)
+        components = 1 if array.ndim == 1 else array.shape[1]
+        arrays.append((attribute, LMESH_DTYPES.index(dtype), components, array))
+    return arrays
+
+
+def write_lmesh(filepath, data, chunk_bytes=0):
+    # arrays are written straight from the foreach_get buffers, chunk_bytes is not needed
+    arrays = lmesh_arrays(data)
+    offset = LMESH_HEADER.size + LMESH_ATTRIBUTE.size * len(arrays)
+    table = []
+    for attribute, dtype, components, array in arrays:
+        offset += -offset % LMESH_PAGE
+        table.append(LMESH_ATTRIBUTE.pack(attribute, dtype, components, 0, offset, array.nbytes))
+        offset += array.nbytes
+    # a renderer may have the previous file mapped, replace it instead of rewriting it in place
+    tmpfile = filepath + '.tmp'
+    with open(tmpfile, 'wb') as f:
+        f.write(LMESH_HEADER.pack(LMESH_MAGIC, LMESH_VERSION, data.num_vertices, data.num_triangles, len(arrays), 0, 0, 0))
+        for entry in table:
+            f.write(entry)
+        for (attribute, dtype, components, array), entry in zip(arrays, table):
+            f.write(b'\0' * (LMESH_ATTRIBUTE.unpack(entry)[4] - f.tell()))
+            array.tofile(f)
+        f.truncate(offset)
+    os.replace(tmpfile, filepath)
+    return offset
+
+
+def read_lmesh(filepath):
+    '''MeshData backed by a read only memory map of an .lmesh file'''
+    data = np.memmap(filepath, dtype=np.uint8, mode='r')
+    magic, version, num_vertices, num_triangles, num_attributes = LMESH_HEADER.unpack_from(data, 0)[:5]
+    if magic != LMESH_MAGIC:
+        raise ValueError('%s is not an lmesh file' % filepath)
+    if version != LMESH_VERSION:
+        raise ValueError('%s has unsupported lmesh version %d' % (filepath, version))
+    arrays = {}
+    for i in range(num_attributes):
+        attribute, dtype, components, _, offset, nbytes = LMESH_ATTRIBUTE.unpack_from(
+            data, LMESH_HEADER.size + i * LMESH_ATTRIBUTE.size)
+        dtype = LMESH_DTYPES[dtype]
+        array = np.frombuffer(data, dtype=dtype, count=nbytes // dtype.itemsize, offset=offset)
+        arrays[LMESH_ATTRIBUTES[attribute]] = array if components == 1 else array.reshape(-1, components)
+    return MeshData(arrays['positions'], arrays.get('normals'), arrays.get('uvs'),
+                    arrays['indices'], arrays.get('material_indices'))
+
+
+MESH_ENCODINGS = {
+    'FLOAT': write_ply,
+    'COMPACT': write_ply_compact,
+}
+
+
+def write_mesh_file(filepath, data, encoding='FLOAT', chunk_bytes=0):
+    # the encoding only applies to ply
+    if filepath.endswith(LMESH_EXTENSION):
+        return write_lmesh(filepath, data, chunk_bytes)
+    return MESH_ENCODINGS[encoding](filepath, data, chunk_bytes)
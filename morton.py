@@ -0,0 +1,53 @@
+import numpy as np
+
+
+# Morton ordering and the bottom up pairing shared by the light and instance
+# bvhs: leaves are sorted along the curve, then neighbours are paired one level
+# at a time until a single root is left.
+
+MORTON_BITS = 10
+
+
+def morton_codes(points):
+    # 30 bit codes, 10 bits per axis, relative to the bounds of points
+    if len(points) == 0:
+        return np.empty(0, dtype=np.uint32)
+    lo = points.min(axis=0)
+    extent = points.max(axis=0) - lo
+    extent[extent == 0] = 1
+    cells = (1 << MORTON_BITS) - 1
+    q = ((points - lo) / extent * cells).astype(np.uint32)
+    codes = np.zeros(len(points), dtype=np.uint32)
+    for axis in range(3):
+        v = q[:, axis]
+        v = (v | (v << 16)) & 0x030000FF
+        v = (v | (v << 8)) & 0x0300F00F
+        v = (v | (v << 4)) & 0x030C30C3
+        v = (v | (v << 2)) & 0x09249249
+        codes |= v << (2 - axis)
+    return codes
+
+
+def morton_order(points):
+    return np.argsort(morton_codes(points), kind='stable')
+
+
+def build_bottom_up(nodes, n, merge):
+    '''Pair the n leaves at the front of nodes into a binary tree, returns the root index
+
+    nodes needs room for 2n - 1 entries, parents follow the leaves level by
+    level. merge(nodes, left, right, parents) fills in the parents of each
+    left/right pair, all three are index arrays.
+    '''
+    level = np.arange(n)
+    count = n
+    while len(level) > 1:
+        pairs = len(level) // 2
+        left = level[0:2 * pairs:2]
+        right = level[1:2 * pairs:2]
+        parents = np.arange(count, count + pairs)
+        merge(nodes, left, right, parents)
+        count += pairs
+        # an unpaired node moves up a level unchanged
+        level = np.concatenate([parents, level[2 * pairs:]])
+    return int(level[0])
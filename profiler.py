@@ -0,0 +1,199 @@
+import os
+import sys
+import json
+import time
+import threading
+import tracemalloc
+from contextlib import contextmanager
+
+
+REPORT_FILENAME = 'export_report.json'
+TRACE_FILENAME = 'export_trace.json'
+
+# objects slower than this are listed individually in the report
+HEAVY_OBJECT_SECONDS = 0.05
+
+
+def peak_memory():
+    # process lifetime high water mark in bytes, None where getrusage is missing (windows)
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def traced_peak():
+    # peak of python and numpy allocations since the last reset, None when not tracing
+    if not tracemalloc.is_tracing():
+        return None
+    return tracemalloc.get_traced_memory()[1]
+
+
+def reset_traced_peak():
+    # reset_peak is python 3.9+, older blenders only get the overall figure
+    if tracemalloc.is_tracing() and hasattr(tracemalloc, 'reset_peak'):
+        tracemalloc.reset_peak()
+        return True
+    return False
+
+
+class ExportProfiler:
+    '''Wall time, object counts, bytes written and peak memory per export stage
+
+    Stage memory is the peak of traced (python and numpy) allocations while the
+    stage ran, a parent stage's peak covers its children. Without tracemalloc
+    running it is None and only the process peak is reported.
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.origin = time.perf_counter()
+        self.stages = []
+        self.objects = []
+        self.current = None
+
+    def now(self):
+        return time.perf_counter() - self.origin
+
+    @contextmanager
+    def stage(self, name, objects=0):
+        record = {
+            'name': name,
+            'start': self.now(),
+            'objects': objects,
+            'bytes': 0,
+        }
+        parent, self.current = self.current, record
+        # the parent keeps what it peaked at so far, the tracer restarts for this stage
+        self.merge_peak(parent, traced_peak())
+        per_stage = reset_traced_peak()
+        try:
+            yield record
+        finally:
+            record['seconds'] = self.now() - record['start']
+            self.merge_peak(record, traced_peak() if per_stage else None)
+            record.setdefault('peak_memory', None)
+            reset_traced_peak()
+            self.merge_peak(parent, record['peak_memory'])
+            self.current = parent
+            self.stages.append(record)
+
+    @staticmethod
+    def merge_peak(record, peak):
+        if record is None or peak is None:
+            return
+        record['peak_memory'] = max(record.get('peak_memory') or 0, peak)
+
+    def add_bytes(self, nbytes):
+        with self.lock:
+            if self.current is not None:
+                self.current['bytes'] += nbytes
+
+    def object_event(self, name, kind, start, seconds, nbytes=0, **extra):
+        event = dict(extra, name=name, kind=kind, start=start, seconds=seconds,
+                     bytes=nbytes, thread=threading.get_ident())
+        with self.lock:
+            self.objects.append(event)
+
+    def heavy_objects(self):
+        heavy = [e for e in self.objects if e['seconds'] >= HEAVY_OBJECT_SECONDS]
+        return sorted(heavy, key=lambda e: e['seconds'], reverse=True)
+
+    def total_seconds(self):
+        return sum(s['seconds'] for s in self.stages)
+
+    def total_bytes(self):
+        return sum(s['bytes'] for s in self.stages)
+
+    def report(self):
+        return {
+            'seconds': self.total_seconds(),
+            'bytes': self.total_bytes(),
+            'peak_memory': peak_memory(),
+            'stages': self.stages,
+            'heavy_objects': self.heavy_objects(),
+        }
+
+    def chrome_trace(self):
+        # chrome://tracing / perfetto "complete" events, timestamps in microseconds
+        pid = os.getpid()
+        main_thread = threading.main_thread().ident
+        events = []
+        for s in self.stages:
+            events.append({
+                'name': s['name'], 'cat': 'stage', 'ph': 'X', 'pid': pid, 'tid': main_thread,
+                'ts': s['start'] * 1e6, 'dur': s['seconds'] * 1e6,
+                'args': {'objects': s['objects'], 'bytes': s['bytes']},
+            })
+        for e in self.objects:
+            events.append({
+                'name': e['name'], 'cat': e['kind'], 'ph': 'X', 'pid': pid, 'tid': e['thread'],
+                'ts': e['start'] * 1e6, 'dur': e['seconds'] * 1e6,
+                'args': {'bytes': e['bytes']},
+            })
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def summary(self):
+        slowest = max(self.stages, key=lambda s: s['seconds'], default=None)
+        text = 'export took %.2fs, wrote %.1f MB' % (self.total_seconds(), self.total_bytes() / 1e6)
+        if slowest is not None:
+            text += ', slowest stage %s (%.2fs)' % (slowest['name'], slowest['seconds'])
+        return text
+
+    def write(self, export_dir, trace=False):
+        with open(os.path.join(export_dir, REPORT_FILENAME), 'w') as f:
+            json.dump(self.report(), f, indent=4)
+        if trace:
+            with open(os.path.join(export_dir, TRACE_FILENAME), 'w') as f:
+                json.dump(self.chrome_trace(), f)
+
+
+active = None
+last = None
+
+
+@contextmanager
+def session(export_dir, trace=False):
+    '''Profile everything inside, nested sessions join the outer one'''
+    global active, last
+    if active is not None:
+        yield active
+        return
+    # per stage memory costs tracemalloc's overhead, so it comes with the trace,
+    # stopped again unless someone else was tracing already
+    started = trace and not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    active = ExportProfiler()
+    try:
+        yield active
+    finally:
+        last, active = active, None
+        if started:
+            tracemalloc.stop()
+    last.write(export_dir, trace)
+    print(last.summary())
+
+
+@contextmanager
+def stage(name, objects=0):
+    if active is None:
+        yield {}
+        return
+    with active.stage(name, objects) as record:
+        yield record
+
+
+def add_bytes(nbytes):
+    if active is not None:
+        active.add_bytes(nbytes)
+
+
+def object_event(name, kind, start, seconds, nbytes=0, **extra):
+    if active is not None:
+        active.object_event(name, kind, start, seconds, nbytes, **extra)
+
+
+def now():
+    return active.now() if active is not None else 0.0
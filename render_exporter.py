@@ -6,18 +6,53 @@ from math import *
 import numpy as np
 import mathutils
 from mathutils import Vector
-import shutil
 import struct
-from io_mesh_ply import export_ply
 import json
+import sys
+import time
+import shlex
+import subprocess
 
 from importlib import reload
 
 if __name__ == "__main__":
     from blender2luminous import material_nodes
+    from blender2luminous import morton
+    from blender2luminous import mesh_io
+    from blender2luminous import export_cache
+    from blender2luminous import worker_pool
+    from blender2luminous import scene_builder
+    from blender2luminous import profiler
+    from blender2luminous import framebuffer
+    from blender2luminous import texture_processing
+    from blender2luminous import envmap_sampling
+    from blender2luminous import light_tables
+    from blender2luminous import scene_bvh
     reload(material_nodes)
+    reload(morton)
+    reload(mesh_io)
+    reload(export_cache)
+    reload(worker_pool)
+    reload(scene_builder)
+    reload(profiler)
+    reload(framebuffer)
+    reload(texture_processing)
+    reload(envmap_sampling)
+    reload(light_tables)
+    reload(scene_bvh)
 else:
     from . import material_nodes
+    from . import morton
+    from . import mesh_io
+    from . import export_cache
+    from . import worker_pool
+    from . import scene_builder
+    from . import profiler
+    from . import framebuffer
+    from . import texture_processing
+    from . import envmap_sampling
+    from . import light_tables
+    from . import scene_bvh
 
 #render engine custom begin
 class LuminousRenderEngine(bpy.types.RenderEngine):
@@ -30,9 +65,115 @@ class LuminousRenderEngine(bpy.types.RenderEngine):
     bl_use_texture_preview = True
     bl_use_texture = True
     
-    def render(self, scene):
-        self.report({'ERROR'}, 'Use export function in PBRT panel.')
-        
+    def render(self, depsgraph):
+        scene = depsgraph.scene
+        if not scene.exportpath:
+            self.report({'ERROR'}, 'Set the output folder in the Luminous panel.')
+            return
+        export_dir = bpy.path.abspath(scene.exportpath)
+        create_directory_if_needed(export_dir)
+
+        self.update_stats('', 'Luminous: exporting')
+        # unchanged meshes and textures are skipped through the export cache
+        export_luminous(export_dir, scene, depsgraph=depsgraph)
+        if self.test_break():
+            return
+
+        scale = scene.render.resolution_percentage / 100.0
+        size_x = int(scene.render.resolution_x * scale)
+        size_y = int(scene.render.resolution_y * scale)
+        fb_path = framebuffer.create(os.path.join(export_dir, FRAMEBUFFER_FILENAME), scene.resolution_x, scene.resolution_y)
+
+        command = renderer_command(scene, export_dir, fb_path)
+        print('Starting renderer:', ' '.join(command))
+        with open(os.path.join(export_dir, RENDER_LOG_FILENAME), 'w') as log:
+            process = subprocess.Popen(command, cwd=export_dir, stdout=log, stderr=subprocess.STDOUT)
+            killed = False
+            try:
+                if self.stream_framebuffer(process, fb_path, size_x, size_y, scene.spp):
+                    # after its last pass the renderer still writes its output image
+                    try:
+                        process.wait(timeout=RENDER_EXIT_SECONDS)
+                    except subprocess.TimeoutExpired:
+                        self.report({'WARNING'}, 'Renderer did not exit after its last pass, stopping it')
+            finally:
+                if process.poll() is None:
+                    killed = True
+                    process.terminate()
+                    process.wait()
+        if process.returncode != 0 and not killed:
+            self.report({'ERROR'}, 'Renderer exited with code %d, see %s' % (process.returncode, RENDER_LOG_FILENAME))
+
+    def stream_framebuffer(self, process, fb_path, size_x, size_y, spp):
+        '''Copy renderer updates into blender until it is done or exits, False when cancelled'''
+        # the renderer writes into the mapped file, only changed regions are copied to blender
+        with framebuffer.MappedFramebuffer(fb_path) as fb:
+            sequence = 0
+            while True:
+                # read before copying, the pixels of the last pass are complete once done is set
+                finished = process.poll() is not None or fb.done
+                sequence = self.poll_framebuffer(fb, sequence, size_x, size_y, spp)
+                if finished:
+                    self.update_framebuffer(fb, None, size_x, size_y)
+                    return True
+                if self.test_break():
+                    return False
+                time.sleep(RENDER_POLL_SECONDS)
+
+    def poll_framebuffer(self, fb, sequence, size_x, size_y, spp):
+        # returns the sequence blender's image is up to date with, see framebuffer.publish
+        current = fb.sequence
+        if current == sequence or current % 2:
+            # nothing new, or the renderer is in the middle of publishing
+            return sequence
+        region = fb.region() if current == sequence + 2 else None
+        samples = fb.samples
+        self.update_framebuffer(fb, region, size_x, size_y)
+        if region is not None and fb.sequence != current:
+            # the renderer published again while the region was read, it may be torn
+            self.update_framebuffer(fb, None, size_x, size_y)
+        self.update_progress(min(samples / max(spp, 1), 1.0))
+        self.update_stats('', 'Luminous: %d / %d samples' % (samples, spp))
+        return current
+
+    def update_framebuffer(self, fb, region, size_x, size_y):
+        if fb.width != size_x or fb.height != size_y:
+            # film and blender resolution differ, resample the whole frame
+            rows = np.arange(size_y) * fb.height // size_y
+            cols = np.arange(size_x) * fb.width // size_x
+            x, y, pixels = 0, 0, fb.pixels[rows][:, cols]
+        elif region is None:
+            x, y, pixels = 0, 0, np.array(fb.pixels)
+        else:
+            x, y, w, h = region
+            pixels = np.array(fb.pixels[y:y + h, x:x + w])
+        h, w = pixels.shape[:2]
+        result = self.begin_result(x, y, w, h)
+        render_pass = result.layers[0].passes["Combined"]
+        try:
+            render_pass.rect.foreach_set(pixels.ravel())
+        except AttributeError:
+            # blender before 2.83 only takes a sequence of pixels
+            render_pass.rect = pixels.reshape(-1, framebuffer.CHANNELS).tolist()
+        self.end_result(result)
+
+FRAMEBUFFER_FILENAME = 'framebuffer.bin'
+RENDER_LOG_FILENAME = 'render.log'
+RENDER_POLL_SECONDS = 0.05
+RENDER_EXIT_SECONDS = 30
+STUB_RENDERER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tools', 'stub_renderer.py')
+
+def renderer_command(scene, export_dir, fb_path):
+    fields = {
+        'scene': os.path.join(export_dir, 'scene.json'),
+        'framebuffer': fb_path,
+        'spp': scene.spp,
+    }
+    if not scene.renderer_command:
+        return [sys.executable, STUB_RENDERER, '--scene', fields['scene'],
+                '--framebuffer', fb_path, '--spp', str(scene.spp)]
+    return [arg.format(**fields) for arg in shlex.split(scene.renderer_command)]
+
 from bl_ui import properties_render
 from bl_ui import properties_material
 for member in dir(properties_render):
@@ -169,6 +310,84 @@ def to_mat(matrix4x4):
     mat = np.array(items).reshape(4,4)
     return mat
 
+# blender -> luminous axis and handedness change, built once
+LUMINOUS_BASIS = to_luminous()
+
+def to_luminous_mats(matrices):
+    # (N,4,4) in the same column-major layout as to_mat, converted in one matmul
+    if not matrices:
+        return np.empty((0, 4, 4))
+    mats = np.array(matrices, dtype=np.float64).transpose(0, 2, 1)
+    return np.matmul(mats, LUMINOUS_BASIS)
+
+def luminous_matrix(object):
+    mat = getattr(object, 'luminous_matrix', None)
+    if mat is None:
+        mat = np.matmul(to_mat(object.matrix_world), LUMINOUS_BASIS)
+    return mat
+
+class ExportObject:
+    '''An evaluated object instance collected from the depsgraph'''
+    def __init__(self, object, matrix_world, name, is_instance=False):
+        self.object = object
+        self.matrix_world = matrix_world
+        self.name = name
+        self.is_instance = is_instance
+        # world matrix already converted to luminous, filled in batches
+        self.luminous_matrix = None
+
+    # everything else (type, data, modifiers, to_mesh...) comes from the evaluated object
+    def __getattr__(self, attr):
+        return getattr(self.object, attr)
+
+def evaluated_depsgraph(scene):
+    if scene == bpy.context.scene:
+        return bpy.context.evaluated_depsgraph_get()
+    # headless exports may target a scene that is not the active one
+    depsgraph = scene.view_layers[0].depsgraph
+    depsgraph.update()
+    return depsgraph
+
+def collect_export_objects(depsgraph):
+    collected = {
+        'MESH': [],
+        'LIGHT': [],
+        'CAMERA': [],
+    }
+    instance_counts = {}
+    for inst in depsgraph.object_instances:
+        obj = inst.object
+        if obj.type not in collected:
+            continue
+        name = obj.name
+        if inst.is_instance:
+            count = instance_counts.get(name, 0)
+            instance_counts[name] = count + 1
+            name = '%s_instance_%d' % (name, count)
+        # the instance iterator is reused, copy the matrix out of it
+        collected[obj.type].append(ExportObject(obj, inst.matrix_world.copy(), name, inst.is_instance))
+
+    for objects in (collected['MESH'], collected['LIGHT']):
+        convert_matrices(objects)
+    return collected
+
+def convert_matrices(objects):
+    mats = to_luminous_mats([obj.matrix_world for obj in objects])
+    for obj, mat in zip(objects, mats):
+        obj.luminous_matrix = mat
+
+def find_export_objects(depsgraph, names=None, type=None):
+    # evaluated objects by name (None where missing) or all of one type, without
+    # walking the instances, for re-exporting part of a scene
+    if names is not None:
+        objects = [depsgraph.objects.get(name) for name in names]
+    else:
+        objects = [obj for obj in depsgraph.objects if obj.type == type]
+    objects = [ExportObject(obj, obj.matrix_world.copy(), obj.name) if obj is not None else None
+               for obj in objects]
+    convert_matrices([obj for obj in objects if obj is not None])
+    return objects
+
 def getTextureInSlotName(textureSlotParam):
     srcfile = textureSlotParam
     head, tail = os.path.split(srcfile)
@@ -177,22 +396,27 @@ def getTextureInSlotName(textureSlotParam):
 
     return tail
 
-def copy_image_to_dst_dir(textureSlotParam):
+def publish_texture(scene, srcfile, fn, cache=None):
+    dstfile = bpy.path.abspath(scene.exportpath + fn)
+    if export_cache.publish_file(srcfile, dstfile, fn, cache,
+                                 scene.texture_copy_mode, scene.texture_verify_hash):
+        profiler.add_bytes(os.path.getsize(dstfile))
+
+def copy_image_to_dst_dir(scene, textureSlotParam, cache=None):
     srcfile = bpy.path.abspath(textureSlotParam)
+    pipeline = texture_processing.active
+    if pipeline is not None and pipeline.supports(srcfile):
+        return pipeline.submit(srcfile)
     texturefilename = getTextureInSlotName(srcfile)
 
-    target_file = bpy.path.abspath(bpy.data.scenes[0].exportpath + 'textures/' + texturefilename)
-    dst_dir = os.path.dirname(target_file)
-    if not os.path.exists(dst_dir):
-         os.makedirs(dst_dir)
-    shutil.copyfile(srcfile, target_file)
+    publish_texture(scene, srcfile, 'textures/' + texturefilename, cache)
     return 'textures/' + texturefilename
 
-def export_texture_from_input(inputSlot, mat):
+def export_texture_from_input(scene, inputSlot, mat, cache=None):
     ret = ""
     for x in inputSlot.links:
         textureName = x.from_node.image.name
-        ret = copy_image_to_dst_dir(x.from_node.image.filepath)
+        ret = copy_image_to_dst_dir(scene, x.from_node.image.filepath, cache)
     return ret
 
 def create_constant_tex(name, val):
@@ -205,42 +429,43 @@ def create_constant_tex(name, val):
         }
     }
 
-def create_image_tex(path):
+def create_image_tex(path, color_space="SRGB"):
     return {
         "type" : "ImageTexture",
         "name" : path,
         "param" : {
             "fn" : path,
-            "color_space": "SRGB"
+            "color_space": color_space
         }
     }
 
-def export_matte(scene_json, mat, mat_name):
+def export_matte(scene, scene_json, mat, mat_name, cache=None):
     print("\nexport matte start !")
 
     Kd = [mat.Kd[0],mat.Kd[1],mat.Kd[2],mat.Kd[3]]
 
-    image_path = export_texture_from_input(mat.inputs[0],mat)
+    image_path = export_texture_from_input(scene, mat.inputs[0],mat, cache)
 
     if image_path:
-        tex_data = create_image_tex(image_path)
+        tex_data = create_image_tex(image_path, texture_processing.color_space(image_path))
     else:
         tex_data = create_constant_tex(mat_name + "_constant", Kd)
 
-    add_textures(scene_json, tex_data)
+    tex_name = scene_json.add_texture(tex_data)
 
     tab = {
         "type": "MatteMaterial",
         "name": mat_name,
         "param": {
-            "diffuse": tex_data["name"]
+            "diffuse": tex_name
         }
     }
-    add_material(scene_json, tab)
+    mat_name = scene_json.add_material(tab)
 
     print("export matte end !")
+    return mat_name
 
-def export_material(scene, scene_json, object, slot_idx):
+def export_material(scene, scene_json, object, slot_idx, cache=None):
     mat = object.material_slots[slot_idx].material 
     if not mat or not mat.use_nodes:
         return
@@ -249,43 +474,136 @@ def export_material(scene, scene_json, object, slot_idx):
         return isinstance(node, material_nodes.MyCustomTreeNode)
 
     print('\nMat name: ', mat.name)
+    mat_name = mat.name
     for node in mat.node_tree.nodes:
         if not is_custom_node(node):
             continue
         if node.bl_idname == 'CustomNodeTypeMatte':
-            export_matte(scene_json, node, mat.name)
-    return mat.name
+            # may resolve to an identical material registered earlier
+            mat_name = export_matte(scene, scene_json, node, mat.name, cache)
+    return mat_name
+
+class MaterialCompiler:
+    '''Translates each material datablock once per export
+
+    Objects sharing a material reuse the first result, and the scene builder's
+    registry folds structurally identical materials into one entry. The memo
+    lives on the scene builder so animation frames can share the base scene's.
+    '''
+    def __init__(self, scene, scene_json, cache=None):
+        self.scene = scene
+        self.scene_json = scene_json
+        self.cache = cache
+        self.memo = scene_json.material_names
+        self.compiled = 0
+        self.hits = 0
+
+    @staticmethod
+    def key(mat):
+        # name_full tells library materials apart from local ones of the same name
+        return getattr(mat, 'name_full', mat.name)
+
+    def compile(self, object, slot_idx):
+        mat = object.material_slots[slot_idx].material
+        if not mat or not mat.use_nodes:
+            return None
+        key = self.key(mat)
+        if key in self.memo:
+            self.hits += 1
+            return self.memo[key]
+        mat_name = export_material(self.scene, self.scene_json, object, slot_idx, self.cache)
+        self.memo[key] = mat_name
+        self.compiled += 1
+        return mat_name
             
 def model_transform(mat):
     mat = []
 
-def export_mesh(scene, scene_json, object, mat_name, i):
-    print('exporting object:' , object.name)
-    bpy.context.view_layer.update()
-    object.data.update()
-    dg = bpy.context.evaluated_depsgraph_get()
-    eval_obj = object.evaluated_get(dg)
-    mesh = eval_obj.to_mesh()
-    if not mesh.loop_triangles and mesh.polygons:
-        mesh.calc_loop_triangles()
-
-    mesh.calc_normals_split()
+# absolute mesh path -> (mtime_ns, mesh_io.mesh_stats) of the file last written there
+written_mesh_stats = {}
+
+def remember_mesh_stats(objFilePath, stats):
+    written_mesh_stats[objFilePath] = (os.stat(objFilePath).st_mtime_ns, stats)
+
+def find_mesh_stats(objFilePath, objFilePathRel, cache=None):
+    # files that were not rewritten this time keep the stats from when they were
+    entry = written_mesh_stats.get(objFilePath)
+    if entry is not None and os.path.exists(objFilePath) and os.stat(objFilePath).st_mtime_ns == entry[0]:
+        return entry[1]
+    if cache is not None:
+        return cache.mesh_stats(objFilePathRel)
+    return None
+
+def write_mesh_data(objFilePath, objFilePathRel, mesh_data, state, cache, chunk_bytes=0, encoding='FLOAT', weld=False):
+    # runs on a worker thread, must not touch bpy
+    start = profiler.now()
+    nbytes = 0
+    # welding builds several full size temporaries, under a memory budget it is skipped
+    weld = weld and chunk_bytes == 0
+    # the cache key covers the unwelded loops, welding is skipped with the write
+    digest = None
+    if cache is not None:
+        digest = export_cache.hash_mesh(mesh_data, '%s|%s|%d|%d' % (state, encoding, weld, chunk_bytes > 0))
+    if digest is not None and cache.is_mesh_current(objFilePathRel, digest):
+        print('mesh unchanged, skip writing:', objFilePathRel)
+        stats = cache.mesh_stats(objFilePathRel)
+        if stats is not None:
+            remember_mesh_stats(objFilePath, stats)
+    else:
+        if weld:
+            mesh_data = mesh_io.weld_vertices(mesh_data)
+        mesh_data = mesh_io.sort_by_material(mesh_data)
+        nbytes = mesh_io.write_mesh_file(objFilePath, mesh_data, encoding, chunk_bytes)
+        stats = mesh_io.mesh_stats(mesh_data)
+        remember_mesh_stats(objFilePath, stats)
+        if digest is not None:
+            cache.update_mesh(objFilePathRel, digest, stats)
+    profiler.add_bytes(nbytes)
+    profiler.object_event(objFilePathRel, 'write_mesh', start, profiler.now() - start, nbytes,
+                          triangles=mesh_data.num_triangles, vertices=mesh_data.num_vertices)
+    return nbytes
+
+def write_mesh(scene, object, objFilePathRel, cache=None, pool=None, chunk_bytes=0):
+    # object is already evaluated, see collect_export_objects
+    start = profiler.now()
+    mesh = object.to_mesh()
+    try:
+        mesh_data = extract_mesh(mesh)
+    finally:
+        # the arrays are copies, free the evaluated mesh right away
+        object.to_mesh_clear()
 
-    objFolderPath = bpy.path.abspath(bpy.data.scenes[0].exportpath + 'meshes/')
+    objFilePath = bpy.path.abspath(scene.exportpath + objFilePathRel)
+    objFolderPath = os.path.dirname(objFilePath)
     if not os.path.exists(objFolderPath):
         print('Meshes directory did not exist, creating: ')
         print(objFolderPath)
         os.makedirs(objFolderPath)
 
-    objFilePath = objFolderPath + object.name + f'.ply' 
-    objFilePathRel = 'meshes/' + object.name + f'.ply'
+    state = export_cache.modifier_state(object)
+    profiler.object_event(object.name, 'extract_mesh', start, profiler.now() - start,
+                          triangles=mesh_data.num_triangles)
+    if pool is None:
+        write_mesh_data(objFilePath, objFilePathRel, mesh_data, state, cache, chunk_bytes,
+                        scene.mesh_encoding, scene.weld_vertices)
+    else:
+        pool.submit(mesh_data.nbytes, write_mesh_data, objFilePath, objFilePathRel, mesh_data, state, cache,
+                    chunk_bytes, scene.mesh_encoding, scene.weld_vertices)
 
+def extract_mesh(mesh):
+    if not mesh.loop_triangles and mesh.polygons:
+        mesh.calc_loop_triangles()
 
-    export_ply.save_mesh(objFilePath, mesh, True, True, True, False)
+    mesh.calc_normals_split()
+    return mesh_io.mesh_to_arrays(mesh)
 
-    mat = to_mat(object.matrix_world)
+def export_mesh(scene, scene_json, object, mat_name, i, cache=None, objFilePathRel=None, pool=None, slot_names=None):
+    print('exporting object:' , object.name)
+    if objFilePathRel is None:
+        objFilePathRel = 'meshes/' + object.name + (scene.file_format if scene.file_format != '.gltf' else '.ply')
+        write_mesh(scene, object, objFilePathRel, cache, pool)
 
-    mat = np.matmul(mat, to_luminous())
+    mat = luminous_matrix(object)
 
     data = {
         "name" : object.name,
@@ -294,38 +612,145 @@ def export_mesh(scene, scene_json, object, mat_name, i):
             "fn": objFilePathRel,
             "subdiv_level": 0,
              "material" : mat_name,
-            'transform': {
-                'type': 'matrix4x4',
-                'param': {
-                    'matrix4x4':  mat.tolist()
-                }
-            },
+            'transform': scene_json.transform(mat),
         }
     }
-    scene_json["shapes"].append(data)
-
-
-def export_meshes(scene, scene_json):
+    # bounds and counts let the renderer build its bvh before loading the file
+    stats = find_mesh_stats(bpy.path.abspath(scene.exportpath + objFilePathRel), objFilePathRel, cache)
+    if stats is not None:
+        world = scene_bvh.world_bounds(stats['bounds'], mat)
+        data['param'].update({
+            'bounds': {
+                'object': stats['bounds'],
+                'world': world,
+            },
+            'num_triangles': stats['num_triangles'],
+            'num_vertices': stats['num_vertices'],
+        })
+        if scene_json.instance_bounds is not None:
+            scene_json.instance_bounds.add(len(scene_json.shapes), world)
+        if scene_json.light_table is not None:
+            scene_json.light_table.add_bounds(world)
+        # triangles are grouped by material index in the file, one range per used slot
+        ranges = stats.get('material_ranges', [])
+        last = len(slot_names) - 1 if slot_names else 0
+        if slot_names and len(ranges) == 1:
+            # every face uses one slot, which need not be the first
+            data['param']['material'] = slot_names[min(ranges[0][0], last)] or ""
+        elif slot_names and len(ranges) > 1:
+            data['param']['material_ranges'] = [{
+                'material': slot_names[min(slot, last)] or "",
+                'first_triangle': first,
+                'num_triangles': count,
+            } for slot, first, count in ranges]
+    scene_json.add_shape(data)
+
+def is_instanceable(object):
+    # without active modifiers the evaluated geometry is exactly object.data
+    return not any(m.show_viewport for m in object.modifiers)
+
+DEFORM_MODIFIERS = {
+    'ARMATURE', 'CAST', 'CLOTH', 'CORRECTIVE_SMOOTH', 'CURVE', 'DISPLACE',
+    'DYNAMIC_PAINT', 'EXPLODE', 'FLUID', 'HOOK', 'LAPLACIANDEFORM', 'LAPLACIANSMOOTH',
+    'LATTICE', 'MESH_CACHE', 'MESH_DEFORM', 'MESH_SEQUENCE_CACHE', 'NODES', 'OCEAN',
+    'PARTICLE_INSTANCE', 'SHRINKWRAP', 'SIMPLE_DEFORM', 'SMOOTH', 'SOFT_BODY',
+    'SURFACE_DEFORM', 'WARP', 'WAVE',
+}
+
+def is_deforming(object):
+    # geometry may change over time, transform-only animation does not count
+    original = object.original
+    if any(m.show_viewport and m.type in DEFORM_MODIFIERS for m in original.modifiers):
+        return True
+    anim = original.animation_data
+    if anim and anim.action and any(fc.data_path.startswith('modifiers[') for fc in anim.action.fcurves):
+        return True
+    data = original.data
+    if data.animation_data:
+        return True
+    return bool(data.shape_keys and data.shape_keys.animation_data)
+
+def export_meshes(scene, scene_json, objects, cache=None, frame=None, dirty=None):
     obj_directory_path = bpy.path.abspath(scene.exportpath + 'meshes')
     obj_filepath =  obj_directory_path + '/meshes.gltf'
     # print(f'[info] export mesh to {obj_filepath}')
     create_directory_if_needed(obj_directory_path)
 
-    if scene.file_format == ".ply":
+    if scene.file_format in (".ply", mesh_io.LMESH_EXTENSION):
+        extension = scene.file_format
 
         def skip(object):
             return object is None or object.type == 'CAMERA' or object.type != 'MESH'
 
-        for i, object in enumerate(scene.objects):
-            if skip(object):
-                continue
-            mat_name = ""
-            for i in range(len(object.material_slots)):
-                mat_name = export_material(scene, scene_json, object, i)
-                break
-            
-            export_mesh(scene, scene_json, object, mat_name, i)
+        # for animation frames only deforming meshes are rewritten, under a per frame name
+        # for live sync only objects whose geometry changed (or was never written)
+        def mesh_file(prefix, name, object):
+            if frame is not None and is_deforming(object):
+                return prefix + name + '_%05d' % frame + extension, True
+            fn = prefix + name + extension
+            if dirty is not None:
+                missing = not os.path.exists(bpy.path.abspath(scene.exportpath + fn))
+                return fn, missing or name in dirty or object.original.name in dirty
+            return fn, frame is None
+
+        instance_users = {}
+        for object in objects:
+            if not skip(object) and is_instanceable(object):
+                instance_users[object.data.name] = instance_users.get(object.data.name, 0) + 1
+
+        # mesh datablock name -> file written for all objects sharing it
+        instance_files = {}
+
+        # with a memory budget, half of it may wait in the queue and writers
+        # interleave vertices in chunks instead of copying whole meshes. Welding
+        # and compact reordering need whole mesh copies and are skipped then, the
+        # extracted loop buffers of a mesh are still held in full
+        queue_bytes = scene.export_queue_memory * 1024 * 1024
+        budget = scene.mesh_memory_budget * 1024 * 1024
+        if budget > 0:
+            queue_bytes = min(queue_bytes, budget // 2)
+
+        # shapes are added once the pool is done, their entries need the written mesh stats
+        shapes = []
+        materials = MaterialCompiler(scene, scene_json, cache)
+
+        # extraction stays on the main thread, encoding and file io go to the pool
+        pool = worker_pool.BoundedWorkerPool(scene.export_threads, queue_bytes)
+        chunk_bytes = 0
+        if budget > 0:
+            chunk_bytes = max(budget // (8 * pool.max_workers), 1 << 20)
+        with pool:
+            for i, object in enumerate(objects):
+                if skip(object):
+                    continue
+                slot_names = [materials.compile(object, slot) for slot in range(len(object.material_slots))]
+                mat_name = slot_names[0] if slot_names else ""
+
+                if is_instanceable(object) and instance_users[object.data.name] > 1:
+                    objFilePathRel = instance_files.get(object.data.name)
+                    if objFilePathRel is None:
+                        objFilePathRel, needs_write = mesh_file('meshes/instances/', object.data.name, object)
+                        if needs_write:
+                            write_mesh(scene, object, objFilePathRel, cache, pool, chunk_bytes)
+                        instance_files[object.data.name] = objFilePathRel
+                else:
+                    objFilePathRel, needs_write = mesh_file('meshes/', object.name, object)
+                    if needs_write:
+                        write_mesh(scene, object, objFilePathRel, cache, pool, chunk_bytes)
+
+                shapes.append((object, mat_name, i, objFilePathRel, slot_names))
+
+        for object, mat_name, i, objFilePathRel, slot_names in shapes:
+            export_mesh(scene, scene_json, object, mat_name, i, cache, objFilePathRel, slot_names=slot_names)
+
+        print('instanced meshes:', len(instance_files), 'shared by',
+              sum(instance_users[name] for name in instance_files), 'objects')
+        print('materials:', materials.compiled, 'compiled,', materials.hits, 'reused,',
+              len(scene_json.materials), 'unique')
+        return
 
+    if frame is not None:
+        print('[warning] gltf meshes are only exported for the first frame')
         return
     
     r = rotate_x(0)
@@ -333,7 +758,7 @@ def export_meshes(scene, scene_json):
     t = np.matmul(s, r)
 
     bpy.ops.export_scene.gltf(filepath=obj_filepath,export_format="GLTF_SEPARATE" )
-    scene_json['shapes'] = [{
+    scene_json.add_shape({
         'name': 'mesh',
         'type': 'model',
         'param': {
@@ -341,25 +766,55 @@ def export_meshes(scene, scene_json):
             'smooth': False,
             'swap_handed': True,
             'subdiv_level': 0,
-            'transform': {
-                'type': 'matrix4x4',
-                'param': {
-                    'matrix4x4':  t.tolist()
-                }
-            }
+            'transform': scene_json.transform(t)
         }
-    }]
+    })
+
+def load_image_pixels(srcfile):
+    # float pixels through blender's image loader, so .hdr and .exr work too
+    image = bpy.data.images.load(srcfile, check_existing=True)
+    users = image.users
+    try:
+        width, height = image.size
+        pixels = np.empty(width * height * image.channels, dtype=np.float32)
+        image.pixels.foreach_get(pixels)
+    finally:
+        if users == 0:
+            bpy.data.images.remove(image)
+    # blender stores the bottom row first
+    return pixels.reshape(height, width, -1)[::-1]
+
+def export_environment_distribution(scene, srcfile, cache=None):
+    # named after the image content, an existing file is always up to date
+    digest = cache.source_hash(srcfile) if cache is not None else export_cache.hash_file(srcfile)
+    stem = os.path.splitext(os.path.basename(srcfile))[0]
+    fn = 'textures/' + stem + '_' + digest[:16] + '.dist'
+    dstfile = bpy.path.abspath(scene.exportpath + fn)
+    if os.path.exists(dstfile):
+        print('environment distribution unchanged:', fn)
+        return fn
+    start = profiler.now()
+    distribution = envmap_sampling.build_distribution(load_image_pixels(srcfile))
+    nbytes = envmap_sampling.write_distribution(dstfile, distribution)
+    profiler.add_bytes(nbytes)
+    profiler.object_event(fn, 'envmap_distribution', start, profiler.now() - start, nbytes)
+    return fn
+
+def environment_radiance(scene, srcfile, fn=None):
+    # average luminance over the sphere, from the distribution when one was written
+    if fn is not None:
+        distribution = envmap_sampling.read_distribution(bpy.path.abspath(scene.exportpath + fn))
+    else:
+        distribution = envmap_sampling.build_distribution(load_image_pixels(srcfile))
+    return envmap_sampling.average_radiance(distribution)
 
-def export_environmentmap(scene, scene_json):
+def export_environmentmap(scene, scene_json, cache=None):
     if scene.environmentmaptpath == '':
         print('export: environmentmap path is empyt')
         return
     environmentMapFileName = get_filename(scene.environmentmaptpath)
     srcfile = bpy.path.abspath(scene.environmentmaptpath)
-    dstdir = bpy.path.abspath(scene.exportpath + 'textures')
-    dstfile = dstdir + '/' + environmentMapFileName
-    create_directory_if_needed(dstdir)
-    shutil.copyfile(srcfile, dstfile)
+    publish_texture(scene, srcfile, 'textures/' + environmentMapFileName, cache)
     environmentmapscaleValue = scene.environmentmapscale
     environment_texture = {
         'name': 'envmap',
@@ -384,59 +839,43 @@ def export_environmentmap(scene, scene_json):
             'key' : 'envmap'
         }
     }
-    if 'textures' in scene_json:
-        scene_json['textures'].append(environment_texture)
-    else:
-        scene_json['textures'] = [environment_texture]
-    if 'lights' in scene_json:
-        scene_json['lights'].append(environment_light)
-    else:
-        scene_json['lights'] = [environment_light]
-
-def export_point_lights(scene, scene_json):
-    lights = []
+    distribution = None
+    if scene.envmap_distribution:
+        distribution = export_environment_distribution(scene, srcfile, cache)
+        environment_light['param']['distribution'] = distribution
+    if scene_json.light_table is not None:
+        radiance = environment_radiance(scene, srcfile, distribution) * environmentmapscaleValue
+        scene_json.light_table.add_envmap(len(scene_json.lights), radiance)
+    scene_json.add_texture(environment_texture)
+    scene_json.add_light(environment_light)
+
+def export_point_lights(scene, scene_json, objects):
     # 不能用bpy.data.objects[bpy.data.lights[0].name]这种形式来获取对象，name不是key，有可能两者不一致，如之前碰到的name=面光，key=g面光
     # for light_data in bpy.data.lights:
     #     light_obj = bpy.data.objects[light_data.name]
     
-    for obj in scene.objects:
+    for obj in objects:
         if obj.type != 'LIGHT' or obj.data.type != 'POINT':
             continue
         light_obj = obj
         light_data = obj.data
         
-        mat = to_mat(light_obj.matrix_world)
-        
-        r = rotate_x(90)
-        s = scale([1,1,-1])
-
-        t = np.matmul(s, r)
-
-        mat = np.matmul(mat, t)
+        mat = luminous_matrix(light_obj)
         
         light = {
             'type': 'PointLight',
             'param': {
-                'transform': {
-                    'type': 'matrix4x4',
-                    'param': {
-                        'matrix4x4':  mat.tolist()
-                    }
-                },
+                'transform': scene_json.transform(mat),
                 'color': list(light_data.color)
             }
         }
-        lights.append(light)
+        if scene_json.light_table is not None:
+            scene_json.light_table.add_point(len(scene_json.lights), mat[3][0:3], light_data.color)
+        scene_json.add_light(light)
 
-    if 'lights' in scene_json:
-        scene_json['lights'].extend(lights)
-    else:
-        scene_json['lights'] = lights
-
-def export_area_lights(scene, scene_json):
-    lights = []
+def export_area_lights(scene, scene_json, objects):
     allow_light_shapes = ['RECTANGLE', 'SQUARE']
-    for obj in scene.objects:
+    for obj in objects:
         if obj.type != 'LIGHT' or obj.data.type != 'AREA' or obj.data.shape not in allow_light_shapes:
             continue
         light_obj = obj
@@ -449,10 +888,7 @@ def export_area_lights(scene, scene_json):
             width = light_data.size
             height = light_data.size_y
             
-        mat = to_mat(light_obj.matrix_world)
-    
-
-        mat = np.matmul(mat, to_luminous())
+        mat = luminous_matrix(light_obj)
         
 
         light = {
@@ -463,35 +899,36 @@ def export_area_lights(scene, scene_json):
                 'height': height,
                 'emission': list(light_data.color),
                 'scale': light_data.energy,
-                'transform': {
-                    'type': 'matrix4x4',
-                    'param': {
-                        'matrix4x4': mat.tolist()
-                    }
-                },
+                'transform': scene_json.transform(mat),
                 'material': ''
             }
         }
-        lights.append(light)
-
-    if 'shapes' in scene_json:
-        scene_json['shapes'].extend(lights)
-    else:
-        scene_json['shapes'] = lights
+        if scene_json.light_table is not None:
+            # blender area lights lie in the local xy plane and emit along -z
+            corners = np.array([[-0.5 * width, -0.5 * height, 0, 1], [0.5 * width, -0.5 * height, 0, 1],
+                                [0.5 * width, 0.5 * height, 0, 1], [-0.5 * width, 0.5 * height, 0, 1]]) @ mat
+            corners = corners[:, 0:3]
+            normal = (np.array([0, 0, -1, 0]) @ mat)[0:3]
+            normal = normal / max(np.linalg.norm(normal), 1e-12)
+            area = np.linalg.norm(np.cross(corners[1] - corners[0], corners[3] - corners[0]))
+            scene_json.light_table.add_quad(len(scene_json.shapes), corners, normal, area,
+                                            light_data.color, light_data.energy)
+        scene_json.add_shape(light)
 
 def yaw_pitch(m):
     pitch = math.degrees(math.atan2(m[1][2], (m[1][1])))
     yaw = math.degrees(math.atan2(m[2][0], m[0][0]))
     return yaw, pitch
 
-def export_camera(scene, scene_json):
+def export_camera(scene, scene_json, objects):
     camera = {}
     camera_obj_blender = None
     camera_data_blender = None
-    for camera_blender in bpy.data.cameras:
-        if camera_blender.type == 'PERSP':
-            camera_obj_blender = bpy.data.objects[camera_blender.name]
-            camera_data_blender = camera_blender
+    # prefer the active scene camera, fall back to the first perspective one
+    for obj in sorted(objects, key=lambda obj: obj.original != scene.camera):
+        if obj.data.type == 'PERSP':
+            camera_obj_blender = obj
+            camera_data_blender = obj.data
             break
     if camera_obj_blender is None:
         print('[error]: no PERSP camera')
@@ -553,10 +990,32 @@ def export_integrator(scene, scene_json):
 		}
 	}
 
+LIGHT_TABLES_FILENAME = 'light_sampler.bin'
+INSTANCE_BVH_FILENAME = 'instances.bin'
+
+def export_instance_bvh(scene, scene_json):
+    filepath = bpy.path.abspath(scene.exportpath + INSTANCE_BVH_FILENAME)
+    profiler.add_bytes(scene_json.instance_bounds.write(filepath))
+    scene_json['acceleration'] = {
+        'instance_bvh': INSTANCE_BVH_FILENAME
+    }
+
 def export_light_sampler(scene, scene_json):
     scene_json['light_sampler'] = {
 		'type': scene.light_sampler
 	}
+    table = scene_json.light_table
+    if table is None or not len(table):
+        return
+    start = profiler.now()
+    filepath = bpy.path.abspath(scene.exportpath + LIGHT_TABLES_FILENAME)
+    nbytes = light_tables.write_tables(filepath, table, bvh=scene.light_sampler == 'BVHLightSampler')
+    profiler.add_bytes(nbytes)
+    profiler.object_event(LIGHT_TABLES_FILENAME, 'light_tables', start, profiler.now() - start, nbytes,
+                          lights=len(table))
+    scene_json['light_sampler']['param'] = {
+        'tables': LIGHT_TABLES_FILENAME
+    }
 
 def export_sampler(scene, scene_json):
     scene_json['sampler'] = {
@@ -580,9 +1039,16 @@ def export_render_output(scene, scene_json):
 		'frame_num' : scene.frame_num
     }
 
-def export_scene(scene_json, filepath):
+def export_scene(scene_json, filepath, indent=4):
     with open(filepath, 'w') as outputfile:
-        json.dump(scene_json, outputfile, indent=4)
+        json.dump(scene_json, outputfile, indent=indent)
+
+def scene_indent(scene):
+    return None if scene.compact_scene else 4
+
+def matrix_precision(scene):
+    # 0 keeps full double precision
+    return scene.matrix_precision if scene.matrix_precision > 0 else None
 
 def find_index(lst, key):
     for i, elm in enumerate(lst):
@@ -609,37 +1075,145 @@ def create_matte(mat, scene_json):
     }
     return ret
 
-def add_textures(scene_json, tex):
-    index = find_index(scene_json["textures"], tex["name"])
-    if index != -1:
-        return index
-    scene_json["textures"].append(tex)
-
-def add_material(scene_json, mat):
-    index = find_index(scene_json["materials"], mat["name"])
-    if index != -1:
-        return index
-    scene_json["materials"].append(mat)
-
-
-def export_luminous(filepath, scene):
-    scene_json = {
-        "textures":[],
-        "materials":[],
-        "shapes":[],
-        "lights":[],
+def export_luminous(filepath, scene, streaming=True, dirty=None, depsgraph=None):
+    with profiler.session(bpy.path.abspath(filepath), scene.write_export_trace):
+        return export_luminous_stages(filepath, scene, streaming, dirty, depsgraph)
+
+def export_luminous_stages(filepath, scene, streaming=True, dirty=None, depsgraph=None):
+    # animation needs the entries in memory to diff frames against them
+    streaming = streaming and scene.compact_scene
+    scene_json = scene_builder.SceneBuilder(bpy.path.abspath(filepath), scene_indent(scene), matrix_precision(scene),
+                                            stream=streaming and scene.stream_scene,
+                                            sidecar=streaming and scene.matrix_sidecar)
+
+    if scene.precompute_light_tables and scene.light_sampler != 'UniformLightSampler':
+        scene_json.light_table = light_tables.LightTable()
+    if scene.write_instance_bvh:
+        scene_json.instance_bounds = scene_bvh.InstanceBounds()
+
+    cache = None
+    if scene.use_export_cache:
+        cache = export_cache.ExportCache(bpy.path.abspath(filepath))
+
+    # evaluate once and hand the evaluated objects to every exporter
+    with profiler.stage('collect_objects') as stage:
+        if depsgraph is None:
+            depsgraph = evaluated_depsgraph(scene)
+        objects = collect_export_objects(depsgraph)
+        stage['objects'] = sum(len(objs) for objs in objects.values())
+
+    # materials hand their textures to the pipeline while meshes are written
+    with texture_processing.session(bpy.path.abspath(filepath), scene, cache) as pipeline:
+        with profiler.stage('export_meshes', len(objects['MESH'])):
+            export_meshes(scene, scene_json, objects['MESH'], cache, dirty=dirty)
+        if pipeline is not None:
+            with profiler.stage('process_textures', len(pipeline.submitted)):
+                profiler.add_bytes(pipeline.join())
+    if scene_json.instance_bounds is not None:
+        with profiler.stage('export_instance_bvh', len(scene_json.instance_bounds)):
+            export_instance_bvh(scene, scene_json)
+    with profiler.stage('export_environmentmap'):
+        export_environmentmap(scene, scene_json, cache)
+    with profiler.stage('export_point_lights', len(objects['LIGHT'])):
+        export_point_lights(scene, scene_json, objects['LIGHT'])
+    with profiler.stage('export_area_lights', len(objects['LIGHT'])):
+        export_area_lights(scene, scene_json, objects['LIGHT'])
+    with profiler.stage('export_camera', len(objects['CAMERA'])):
+        export_camera(scene, scene_json, objects['CAMERA'])
+    with profiler.stage('export_settings'):
+        export_integrator(scene, scene_json)
+        export_light_sampler(scene, scene_json)
+        export_sampler(scene, scene_json)
+        export_filter(scene, scene_json)
+        export_render_output(scene, scene_json)
+
+    scene_json_path = bpy.path.abspath(filepath + '/scene.json')
+    with profiler.stage('export_scene', len(scene_json.shapes) + len(scene_json.lights)):
+        scene_json.write(scene_json_path)
+        profiler.add_bytes(os.path.getsize(scene_json_path))
+
+    if cache is not None:
+        cache.save()
+
+    return scene_json
+
+def diff_entries(base, current):
+    # named entries are matched by name, unnamed ones (point lights) by position
+    base_entries = {elm.get('name', i): elm for i, elm in enumerate(base)}
+    changed = []
+    for i, elm in enumerate(current):
+        key = elm.get('name', i)
+        if base_entries.get(key) != elm:
+            changed.append(dict(elm, index=i))
+    return changed
+
+def export_frame_delta(filepath, scene, base_json, frame, cache=None):
+    scene.frame_set(frame)
+    print('Exporting frame:', frame)
+    frame_json = scene_builder.SceneBuilder(precision=matrix_precision(scene))
+    # materials and textures never change in a delta, reuse the names the base scene registered
+    frame_json.material_names = base_json.material_names
+
+    depsgraph = evaluated_depsgraph(scene)
+    objects = collect_export_objects(depsgraph)
+
+    export_meshes(scene, frame_json, objects['MESH'], cache, frame)
+    export_point_lights(scene, frame_json, objects['LIGHT'])
+    export_area_lights(scene, frame_json, objects['LIGHT'])
+    export_camera(scene, frame_json, objects['CAMERA'])
+
+    delta = {
+        'frame': frame,
+        'base': 'scene.json',
+        'num_shapes': len(frame_json.shapes),
+        'num_lights': len(frame_json.lights),
+        'shapes': diff_entries(base_json.shapes, frame_json.shapes),
+        'lights': diff_entries(base_json.lights, frame_json.lights),
     }
-
-    export_meshes(scene, scene_json)
-    export_environmentmap(scene, scene_json)
-    export_point_lights(scene, scene_json)
-    export_area_lights(scene, scene_json)
-    export_camera(scene, scene_json)
-    export_integrator(scene, scene_json)
-    export_light_sampler(scene, scene_json)
-    export_sampler(scene, scene_json)
-    export_filter(scene, scene_json)
-    export_render_output(scene, scene_json)
-
-    export_scene(scene_json, bpy.path.abspath(filepath + '/scene.json'))
+    if 'camera' in frame_json and frame_json['camera'] != base_json.get('camera'):
+        delta['camera'] = frame_json['camera']
+
+    delta_fn = 'frames/%05d.json' % frame
+    delta_path = bpy.path.abspath(filepath + '/' + delta_fn)
+    create_directory_if_needed(bpy.path.abspath(filepath + '/frames'))
+    export_scene(delta, delta_path, scene_indent(scene))
+    profiler.add_bytes(os.path.getsize(delta_path))
+    return delta_fn
+
+def export_luminous_animation(filepath, scene):
+    with profiler.session(bpy.path.abspath(filepath), scene.write_export_trace):
+        # one pipeline for all frames so every frame references the same texture files
+        with texture_processing.session(bpy.path.abspath(filepath), scene):
+            return export_luminous_animation_frames(filepath, scene)
+
+def export_luminous_animation_frames(filepath, scene):
+    frame_current = scene.frame_current
+    frame_start = scene.batch_frame_start
+    frame_end = max(scene.batch_frame_end, frame_start)
+
+    # the first frame is a complete scene, static geometry is only written there
+    scene.frame_set(frame_start)
+    base_json = export_luminous(filepath, scene, streaming=False)
+
+    cache = None
+    if scene.use_export_cache:
+        cache = export_cache.ExportCache(bpy.path.abspath(filepath))
+
+    frames = ['scene.json']
+    try:
+        for frame in range(frame_start + 1, frame_end + 1):
+            with profiler.stage('frame %05d' % frame):
+                frames.append(export_frame_delta(filepath, scene, base_json, frame, cache))
+    finally:
+        scene.frame_set(frame_current)
+        if cache is not None:
+            cache.save()
+
+    animation = {
+        'frame_start': frame_start,
+        'frame_end': frame_end,
+        'frames': frames,
+    }
+    export_scene(animation, bpy.path.abspath(filepath + '/animation.json'), scene_indent(scene))
+    return animation
     
@@ -1,5 +1,7 @@
 import bpy
 from . import render_exporter
+from . import profiler
+from . import live_sync
 
 class ExportPbrtScene(bpy.types.Operator):
     bl_idname = 'scene.export'
@@ -10,14 +12,14 @@ class ExportPbrtScene(bpy.types.Operator):
     def execute(self, context):
         print("Starting calling pbrt_export")
         print("Output path:")
-        filepath_full = bpy.path.abspath(bpy.data.scenes[0].exportpath)
+        scene = context.scene
+        filepath_full = bpy.path.abspath(scene.exportpath)
         print(filepath_full)
-        # for frameNumber in range(bpy.data.scenes['Scene'].batch_frame_start, bpy.data.scenes['Scene'].batch_frame_end +1):
-        #     bpy.data.scenes['Scene'].frame_set(frameNumber)
-        #     print("Exporting frame: %s" % (frameNumber))
-        #     render_exporter.export_luminous(filepath_full, bpy.data.scenes['Scene'], '{0:05d}'.format(frameNumber))
-        render_exporter.export_luminous(filepath_full, bpy.data.scenes['Scene'])
-        self.report({'INFO'}, "Export complete.")
+        if scene.export_animation:
+            render_exporter.export_luminous_animation(filepath_full, scene)
+        else:
+            render_exporter.export_luminous(filepath_full, scene)
+        self.report({'INFO'}, "Export complete: " + profiler.last.summary())
         return {"FINISHED"}
 
 class LuminousRenderSettingsPanel(bpy.types.Panel):
@@ -60,6 +62,55 @@ class LuminousRenderSettingsPanel(bpy.types.Panel):
         row.prop(scene, "frame_num")
         row = layout.row()
         row.prop(scene, "file_format")
+        if scene.file_format == ".ply":
+            row.prop(scene, "mesh_encoding")
+        if scene.file_format != ".gltf":
+            row.prop(scene, "weld_vertices")
+        row = layout.row()
+        row.prop(scene, "use_export_cache")
+        row = layout.row()
+        row.prop(scene, "texture_copy_mode")
+        row.prop(scene, "texture_verify_hash")
+        row = layout.row()
+        row.prop(scene, "process_textures")
+        if scene.process_textures:
+            row = layout.row()
+            row.prop(scene, "texture_max_size")
+            row.prop(scene, "texture_format")
+            row.prop(scene, "texture_workers")
+        row = layout.row()
+        row.prop(scene, "compact_scene")
+        row.prop(scene, "matrix_precision")
+        if scene.compact_scene:
+            row = layout.row()
+            row.prop(scene, "stream_scene")
+            row.prop(scene, "matrix_sidecar")
+        row = layout.row()
+        row.prop(scene, "write_instance_bvh")
+        row = layout.row()
+        row.prop(scene, "export_threads")
+        row.prop(scene, "export_queue_memory")
+        row = layout.row()
+        row.prop(scene, "mesh_memory_budget")
+        row = layout.row()
+        row.prop(scene, "write_export_trace")
+
+        layout.label(text="Animation:")
+        row = layout.row()
+        row.prop(scene, "export_animation")
+        if scene.export_animation:
+            row = layout.row()
+            row.prop(scene, "batch_frame_start")
+            row.prop(scene, "batch_frame_end")
+
+        layout.label(text="Renderer command (F12)")
+        row = layout.row()
+        row.prop(scene, "renderer_command")
+
+        layout.label(text="Live export:")
+        row = layout.row()
+        row.prop(scene, "live_export")
+        row.prop(scene, "live_export_delay")
 
         layout.label(text="Environment Map")
         row = layout.row()
@@ -68,6 +119,8 @@ class LuminousRenderSettingsPanel(bpy.types.Panel):
         layout.label(text="Environment map scale:")
         row = layout.row()
         row.prop(scene, "environmentmapscale")
+        row = layout.row()
+        row.prop(scene, "envmap_distribution")
 
         layout.label(text="Film settings:")
         row = layout.row()
@@ -117,6 +170,9 @@ class LuminousRenderSettingsPanel(bpy.types.Panel):
         layout.label(text="Light strategy:")
         row = layout.row()
         row.prop(scene,"light_sampler")
+        if scene.light_sampler != "UniformLightSampler":
+            row = layout.row()
+            row.prop(scene, "precompute_light_tables")
         
         layout.label(text="Export:")
         row = layout.row()
@@ -165,8 +221,47 @@ def register():
     integrators = [("PT", "PT", "", 1), ("wavefrontPT", "wavefrontPT", "", 2)]
     bpy.types.Scene.integrators = bpy.props.EnumProperty(name = "Name", items=integrators , default="PT")
     
-    file_formats = [(".ply", ".ply", "", 1), (".gltf", ".gltf", "", 2)]
+    file_formats = [(".ply", ".ply", "", 1), (".gltf", ".gltf", "", 2), 
+                    (".lmesh", ".lmesh", "Page aligned binary arrays the renderer can mmap", 3)]
     bpy.types.Scene.file_format = bpy.props.EnumProperty(name = "Name", items=file_formats , default=".gltf")
+    bpy.types.Scene.use_export_cache = bpy.props.BoolProperty(name="Skip unchanged meshes", 
+                                                            description="Keep a content hash manifest in the export folder and skip rewriting unchanged files", default = True)
+    texture_copy_modes = [("COPY", "copy", "", 1), 
+                          ("HARDLINK", "hardlink", "", 2), 
+                          ("REFLINK", "reflink", "", 3)]
+    bpy.types.Scene.texture_copy_mode = bpy.props.EnumProperty(name = "Texture publish", items=texture_copy_modes , default="COPY")
+    bpy.types.Scene.texture_verify_hash = bpy.props.BoolProperty(name="Verify texture hash", 
+                                                            description="Compare content hashes when a texture's mtime changed but its size did not", default = False)
+    bpy.types.Scene.compact_scene = bpy.props.BoolProperty(name="Compact scene.json", 
+                                                            description="Write scene.json without indentation", default = False)
+    bpy.types.Scene.matrix_precision = bpy.props.IntProperty(name = "Matrix digits", description = "Decimal digits kept for matrices, 0 keeps full precision", 
+                                                default = 0, min = 0, max = 17)
+    bpy.types.Scene.stream_scene = bpy.props.BoolProperty(name="Stream shapes and lights", 
+                                                            description="Write shape and light entries out as they are exported instead of keeping them in memory", default = False)
+    bpy.types.Scene.matrix_sidecar = bpy.props.BoolProperty(name="Binary matrices", 
+                                                            description="Store transform matrices in scene.bin and reference them by offset", default = False)
+    bpy.types.Scene.write_export_trace = bpy.props.BoolProperty(name="Write Chrome trace", 
+                                                            description="Write export_trace.json for chrome://tracing next to scene.json and trace per stage peak memory (slower export)", default = False)
+    bpy.types.Scene.export_threads = bpy.props.IntProperty(name = "Export threads", description = "Worker threads writing mesh files, 0 uses all cores", 
+                                                default = 0, min = 0, max = 256)
+    bpy.types.Scene.export_queue_memory = bpy.props.IntProperty(name = "Queue memory (MB)", description = "Maximum extracted mesh data waiting to be written", 
+                                                default = 2048, min = 64, max = 1048576)
+    mesh_encodings = [("FLOAT", "float", "float32 positions, normals and uvs", 1), 
+                      ("COMPACT", "compact", "Quantized positions, octahedral normals, half uvs, locality ordered triangles", 2)]
+    bpy.types.Scene.mesh_encoding = bpy.props.EnumProperty(name = "Mesh encoding", items=mesh_encodings , default="FLOAT")
+    bpy.types.Scene.weld_vertices = bpy.props.BoolProperty(name="Weld vertices", 
+                                                            description="Merge split loop vertices with identical position, normal and uv", default = True)
+    bpy.types.Scene.process_textures = bpy.props.BoolProperty(name="Process textures", 
+                                                            description="Clamp, mip map and convert image textures to .lmtex on a process pool (needs Pillow)", default = False)
+    bpy.types.Scene.texture_max_size = bpy.props.IntProperty(name = "Max size", description = "Longest texture side after processing, 0 keeps the source size", 
+                                                default = 4096, min = 0, max = 65536)
+    texture_formats = [("SRGB8", "sRGB 8 bit", "", 1), 
+                       ("LINEAR_HALF", "linear half", "", 2)]
+    bpy.types.Scene.texture_format = bpy.props.EnumProperty(name = "Format", items=texture_formats , default="SRGB8")
+    bpy.types.Scene.texture_workers = bpy.props.IntProperty(name = "Texture processes", description = "Texture worker processes, 0 uses all cores", 
+                                                default = 0, min = 0, max = 256)
+    bpy.types.Scene.mesh_memory_budget = bpy.props.IntProperty(name = "Mesh memory budget (MB)", description = "Bound queued mesh data and write meshes in chunks, skips welding and compact reordering. Each mesh is still extracted whole. 0 disables", 
+                                                default = 0, min = 0, max = 1048576)
     
 
     light_sampler = [("UniformLightSampler", "uniform", "", 1), 
@@ -182,6 +277,13 @@ def register():
     bpy.types.Scene.fb_state = bpy.props.EnumProperty(name = "framebuffer_state", 
                     items=framebuffer_state , default="render")
 
+    bpy.types.Scene.write_instance_bvh = bpy.props.BoolProperty(name="Write instance BVH", 
+                                                            description="Write a bvh over the world bounds of all meshes to instances.bin", default = False)
+    bpy.types.Scene.precompute_light_tables = bpy.props.BoolProperty(name="Precompute light tables", 
+                                                            description="Write light bounds, power alias table and light bvh to light_sampler.bin", default = False)
+    bpy.types.Scene.envmap_distribution = bpy.props.BoolProperty(name="Precompute sampling tables", 
+                                                            description="Write the environment map luminance cdf next to it so the renderer can skip building it", default = False)
+
     bpy.types.Scene.resolution_x = bpy.props.IntProperty(name = "X", description = "Resolution x", default = 768, min = 1, max = 9999)
     bpy.types.Scene.resolution_y = bpy.props.IntProperty(name = "Y", description = "Resolution y", default = 768, min = 1, max = 9999)
 
@@ -191,6 +293,18 @@ def register():
                                                             default = 1, min = 1, max = 9999999)
     bpy.types.Scene.batch_frame_end = bpy.props.IntProperty(name = "Frame end", description = "Frame end", 
                                                             default = 1, min = 1, max = 9999999)
+    bpy.types.Scene.export_animation = bpy.props.BoolProperty(name="Export animation", 
+                                                            description="Export the first frame as a full scene and per frame deltas for the rest", default = False)
+    bpy.types.Scene.renderer_command = bpy.props.StringProperty(
+        name="",
+        description="Renderer launched on F12, {scene}, {framebuffer} and {spp} are substituted. Empty runs the stub renderer",
+        default="",
+        maxlen=1024)
+    bpy.types.Scene.live_export = bpy.props.BoolProperty(name="Live export", 
+                                                            description="Re-export changed meshes and scene.json while editing", default = False, 
+                                                            update=live_sync.update_live_export)
+    bpy.types.Scene.live_export_delay = bpy.props.FloatProperty(name = "Delay (s)", description = "Wait this long after the last edit before exporting", 
+                                                            default = 0.5, min = 0.0, max = 60.0, update=live_sync.update_live_export_delay)
 
     bpy.types.Scene.rr_threshold = bpy.props.FloatProperty(name = "rr Threshold", description = "rr Threshold", 
                                                         default = 1.0, min = 0.001, max = 9999)
@@ -0,0 +1,209 @@
+import os
+import json
+
+import numpy as np
+
+
+class Registry:
+    '''Named scene.json entries in insertion order, looked up by name or by content'''
+    def __init__(self):
+        self.entries = []
+        self.name_index = {}
+        self.content_index = {}
+
+    @staticmethod
+    def content_key(entry):
+        return json.dumps({k: v for k, v in entry.items() if k != 'name'}, sort_keys=True)
+
+    def add(self, entry):
+        # returns the name the entry has to be referenced by
+        index = self.name_index.get(entry['name'])
+        if index is not None:
+            return self.entries[index]['name']
+        key = self.content_key(entry)
+        index = self.content_index.get(key)
+        if index is not None:
+            # identical entry under another name, alias it instead of duplicating
+            self.name_index[entry['name']] = index
+            return self.entries[index]['name']
+        index = len(self.entries)
+        self.entries.append(entry)
+        self.name_index[entry['name']] = index
+        self.content_index[key] = index
+        return entry['name']
+
+    def index(self, name):
+        return self.name_index.get(name, -1)
+
+    def __contains__(self, name):
+        return name in self.name_index
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+
+class EntryStream:
+    '''List entries serialized to a temporary file as soon as they are added'''
+    def __init__(self, filepath, dumps):
+        self.filepath = filepath
+        self.dumps = dumps
+        self.count = 0
+        self.file = open(filepath, 'w')
+
+    def append(self, entry):
+        if self.count:
+            self.file.write(',')
+        self.file.write(self.dumps(entry))
+        self.count += 1
+
+    def copy_to(self, outputfile):
+        self.file.close()
+        with open(self.filepath, 'r') as f:
+            while True:
+                chunk = f.read(1 << 20)
+                if not chunk:
+                    break
+                outputfile.write(chunk)
+        os.remove(self.filepath)
+
+    def __len__(self):
+        return self.count
+
+
+class BinarySidecar:
+    '''Raw little-endian float32 arrays referenced from scene.json by byte offset'''
+    ALIGNMENT = 16
+
+    def __init__(self, filepath, fn):
+        self.fn = fn
+        self.offset = 0
+        self.file = open(filepath, 'wb')
+
+    def append(self, array):
+        data = np.ascontiguousarray(array, dtype='<f4')
+        padding = -self.offset % self.ALIGNMENT
+        if padding:
+            self.file.write(b'\0' * padding)
+            self.offset += padding
+        offset = self.offset
+        data.tofile(self.file)
+        self.offset += data.nbytes
+        return offset
+
+    def close(self):
+        self.file.close()
+
+
+class SceneBuilder:
+    '''Collects everything that ends up in scene.json
+
+    With stream set, shapes and lights are written out as they are added and
+    the file can only be produced with write(). With sidecar, matrices go to a
+    binary file instead of the json.
+    '''
+    def __init__(self, export_dir=None, indent=4, precision=None, stream=False, sidecar=False):
+        self.textures = Registry()
+        self.materials = Registry()
+        self.settings = {}
+        # light_tables.LightTable when the light sampler tables are precomputed
+        self.light_table = None
+        # scene_bvh.InstanceBounds when the instance bvh is written
+        self.instance_bounds = None
+        # material datablock -> registered material name, see MaterialCompiler
+        self.material_names = {}
+        self.indent = indent
+        self.precision = precision
+        self.stream = stream
+        self.sidecar = None
+        if stream:
+            dumps = lambda entry: json.dumps(entry, separators=(',', ':'))
+            self.shapes = EntryStream(os.path.join(export_dir, 'scene.shapes.tmp'), dumps)
+            self.lights = EntryStream(os.path.join(export_dir, 'scene.lights.tmp'), dumps)
+        else:
+            self.shapes = []
+            self.lights = []
+        if sidecar:
+            self.sidecar = BinarySidecar(os.path.join(export_dir, 'scene.bin'), 'scene.bin')
+
+    def transform(self, mat):
+        if self.sidecar is not None:
+            return {
+                'type': 'matrix4x4',
+                'param': {
+                    'buffer': self.sidecar.fn,
+                    'offset': self.sidecar.append(mat)
+                }
+            }
+        mat = np.asarray(mat, dtype=np.float64)
+        if self.precision is not None:
+            mat = np.round(mat, self.precision)
+        return {
+            'type': 'matrix4x4',
+            'param': {
+                'matrix4x4': mat.tolist()
+            }
+        }
+
+    def add_texture(self, tex):
+        return self.textures.add(tex)
+
+    def add_material(self, mat):
+        return self.materials.add(mat)
+
+    def add_shape(self, shape):
+        self.shapes.append(shape)
+
+    def add_light(self, light):
+        self.lights.append(light)
+
+    # camera, integrator, sampler... are single entries
+    def __setitem__(self, key, value):
+        self.settings[key] = value
+
+    def __getitem__(self, key):
+        return self.settings[key]
+
+    def __contains__(self, key):
+        return key in self.settings
+
+    def get(self, key, default=None):
+        return self.settings.get(key, default)
+
+    def to_json(self):
+        if self.stream:
+            raise RuntimeError('streamed scene entries are already on disk, use write()')
+        scene_json = {
+            "textures": self.textures.entries,
+            "materials": self.materials.entries,
+            "shapes": self.shapes,
+            "lights": self.lights,
+        }
+        scene_json.update(self.settings)
+        return scene_json
+
+    def separators(self):
+        return (',', ': ') if self.indent is not None else (',', ':')
+
+    def write(self, filepath):
+        if self.sidecar is not None:
+            self.sidecar.close()
+        if not self.stream:
+            with open(filepath, 'w') as outputfile:
+                json.dump(self.to_json(), outputfile, indent=self.indent, separators=self.separators())
+            return
+        # same layout as to_json, streamed entries are spliced in from their temp files
+        dumps = lambda value: json.dumps(value, separators=(',', ':'))
+        with open(filepath, 'w') as outputfile:
+            outputfile.write('{"textures":' + dumps(self.textures.entries))
+            outputfile.write(',"materials":' + dumps(self.materials.entries))
+            outputfile.write(',"shapes":[')
+            self.shapes.copy_to(outputfile)
+            outputfile.write('],"lights":[')
+            self.lights.copy_to(outputfile)
+            outputfile.write(']')
+            for key, value in self.settings.items():
+                outputfile.write(',' + dumps(key) + ':' + dumps(value))
+            outputfile.write('}')
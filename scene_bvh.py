@@ -0,0 +1,110 @@
+import os
+import struct
+
+import numpy as np
+
+from . import morton
+
+
+# Top level bvh over the world space bounds of the exported shapes, so the
+# renderer can build its instance level structure without loading geometry.
+#
+# instances.bin, little-endian, arrays 16 byte aligned:
+#   header  '4s5I'  magic, version, num_nodes, root, num_shapes, reserved
+#   nodes   NODE_DTYPE [num_nodes]  leaves first, root last
+# Leaves store the index of their entry in scene.json's shapes, inner nodes -1.
+
+MAGIC = b'LMIB'
+VERSION = 1
+HEADER = struct.Struct('<4s5I')
+ALIGNMENT = 16
+
+NODE_DTYPE = np.dtype([
+    ('bounds_min', '<f4', 3),
+    ('bounds_max', '<f4', 3),
+    ('child0', '<i4'),
+    ('child1', '<i4'),
+    ('shape', '<i4'),
+    ('pad', '<i4'),
+])
+
+
+def world_bounds(bounds, mat):
+    '''Transform an object space box by a row vector matrix, returns the enclosing box'''
+    lo, hi = np.asarray(bounds, dtype=np.float64)
+    corners = np.array([[x, y, z, 1.0] for x in (lo[0], hi[0]) for y in (lo[1], hi[1]) for z in (lo[2], hi[2])])
+    corners = (corners @ np.asarray(mat, dtype=np.float64))[:, 0:3]
+    return [corners.min(axis=0).tolist(), corners.max(axis=0).tolist()]
+
+
+def build_bvh(shapes, bounds_min, bounds_max):
+    '''Binary bvh over morton ordered boxes, see morton.build_bottom_up'''
+    n = len(shapes)
+    if n == 0:
+        return np.empty(0, dtype=NODE_DTYPE), 0
+    bounds_min = np.asarray(bounds_min, dtype=np.float64)
+    bounds_max = np.asarray(bounds_max, dtype=np.float64)
+    order = morton.morton_order(0.5 * (bounds_min + bounds_max))
+    nodes = np.zeros(2 * n - 1, dtype=NODE_DTYPE)
+    nodes['bounds_min'][:n] = bounds_min[order]
+    nodes['bounds_max'][:n] = bounds_max[order]
+    nodes['child0'] = -1
+    nodes['child1'] = -1
+    nodes['shape'] = -1
+    nodes['shape'][:n] = np.asarray(shapes)[order]
+    return nodes, morton.build_bottom_up(nodes, n, merge_nodes)
+
+
+def merge_nodes(nodes, left, right, parents):
+    nodes['bounds_min'][parents] = np.minimum(nodes['bounds_min'][left], nodes['bounds_min'][right])
+    nodes['bounds_max'][parents] = np.maximum(nodes['bounds_max'][left], nodes['bounds_max'][right])
+    nodes['child0'][parents] = left
+    nodes['child1'][parents] = right
+
+
+class InstanceBounds:
+    '''World space bounds of the shapes added so far'''
+    def __init__(self):
+        self.shapes = []
+        self.bounds_min = []
+        self.bounds_max = []
+        # shape index -> position in the lists above
+        self.positions = {}
+
+    def add(self, shape_index, bounds):
+        self.positions[shape_index] = len(self.shapes)
+        self.shapes.append(shape_index)
+        self.bounds_min.append(bounds[0])
+        self.bounds_max.append(bounds[1])
+
+    def update(self, shape_index, bounds):
+        # live export replaces the bounds of a moved or edited shape
+        i = self.positions.get(shape_index)
+        if i is None:
+            self.add(shape_index, bounds)
+            return
+        self.bounds_min[i] = bounds[0]
+        self.bounds_max[i] = bounds[1]
+
+    def __len__(self):
+        return len(self.shapes)
+
+    def write(self, filepath):
+        nodes, root = build_bvh(self.shapes, self.bounds_min, self.bounds_max)
+        tmpfile = filepath + '.tmp'
+        with open(tmpfile, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, len(nodes), root, len(self.shapes), 0))
+            f.write(b'\0' * (-f.tell() % ALIGNMENT))
+            nodes.tofile(f)
+            nbytes = f.tell()
+        os.replace(tmpfile, filepath)
+        return nbytes
+
+
+def read_bvh(filepath):
+    data = np.memmap(filepath, dtype=np.uint8, mode='r')
+    magic, version, num_nodes, root, num_shapes, _ = HEADER.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise ValueError('%s is not an instance bvh' % filepath)
+    offset = HEADER.size + (-HEADER.size % ALIGNMENT)
+    return np.frombuffer(data, dtype=NODE_DTYPE, count=num_nodes, offset=offset), root
@@ -0,0 +1,144 @@
+import os
+import sys
+import multiprocessing
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+
+from . import export_cache
+
+
+# spawned workers can't import this package (its __init__ imports bpy), so the
+# worker code lives in tools/ and is imported by its plain module name
+TOOLS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tools')
+if TOOLS_DIR not in sys.path:
+    sys.path.append(TOOLS_DIR)
+import texture_worker
+
+PROCESSED_EXTENSION = '.lmtex'
+
+
+def pillow_available():
+    try:
+        import PIL
+    except ImportError:
+        return False
+    return True
+
+
+@contextmanager
+def hidden_main():
+    # spawned workers re-run __main__ (a blender script importing bpy) unless it looks anonymous
+    main = sys.modules.get('__main__')
+    saved = {key: getattr(main, key) for key in ('__file__', '__spec__') if getattr(main, key, None) is not None}
+    for key in saved:
+        setattr(main, key, None) if key == '__spec__' else delattr(main, key)
+    try:
+        yield
+    finally:
+        for key, value in saved.items():
+            setattr(main, key, value)
+
+
+class TexturePipeline:
+    '''Converts textures to mip mapped .lmtex files on a process pool
+
+    Outputs are named after the source content hash and the settings, so a
+    file that already exists is up to date and is never processed again.
+    High bit depth and float sources are linear data and always become
+    LINEAR_HALF, whatever format_name asks for.
+    '''
+    def __init__(self, export_dir, max_size=4096, format_name='SRGB8', workers=0, cache=None):
+        self.export_dir = export_dir
+        self.max_size = max_size
+        self.format_name = format_name
+        self.workers = workers if workers > 0 else (os.cpu_count() or 1)
+        self.cache = cache
+        self.submitted = {}
+        self.hashes = {}
+        self.formats = {}
+        self.executor = None
+
+    def supports(self, srcfile):
+        return os.path.splitext(srcfile)[1].lower() in texture_worker.EXTENSIONS
+
+    def source_hash(self, srcfile):
+        digest = self.hashes.get(srcfile)
+        if digest is None:
+            if self.cache is not None:
+                digest = self.cache.source_hash(srcfile)
+            else:
+                digest = export_cache.hash_file(srcfile)
+            self.hashes[srcfile] = digest
+        return digest
+
+    def source_format(self, srcfile):
+        format_name = self.formats.get(srcfile)
+        if format_name is None:
+            format_name = 'LINEAR_HALF' if texture_worker.is_linear(srcfile) else self.format_name
+            self.formats[srcfile] = format_name
+        return format_name
+
+    def output_name(self, srcfile):
+        # the format ends the name, color_space reads it back from there
+        stem = os.path.splitext(os.path.basename(srcfile))[0]
+        key = '%s_%d_%s' % (self.source_hash(srcfile)[:16], self.max_size, self.source_format(srcfile).lower())
+        return 'textures/' + stem + '_' + key + PROCESSED_EXTENSION
+
+    def submit(self, srcfile):
+        # returns the file name scene.json should reference, the file itself may still be in flight
+        fn = self.output_name(srcfile)
+        dstfile = os.path.join(self.export_dir, fn)
+        if fn in self.submitted or os.path.exists(dstfile):
+            return fn
+        os.makedirs(os.path.dirname(dstfile), exist_ok=True)
+        if self.executor is None:
+            # never fork blender
+            self.executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                mp_context=multiprocessing.get_context('spawn'))
+        # workers are started on submit
+        with hidden_main():
+            self.submitted[fn] = self.executor.submit(texture_worker.process_texture, srcfile, dstfile,
+                                                      self.max_size, self.source_format(srcfile))
+        return fn
+
+    def join(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+        futures, self.submitted = self.submitted, {}
+        # re-raise the first worker error on the calling thread
+        return sum(f.result() for f in futures.values())
+
+
+active = None
+
+
+@contextmanager
+def session(export_dir, scene, cache=None):
+    '''Route textures through a pipeline while the export runs, nested sessions join the outer one'''
+    global active
+    if active is not None:
+        yield active
+        return
+    if not scene.process_textures:
+        yield None
+        return
+    if not pillow_available():
+        print('[warning] texture processing needs Pillow, copying textures instead')
+        yield None
+        return
+    active = TexturePipeline(export_dir, scene.texture_max_size, scene.texture_format,
+                             scene.texture_workers, cache)
+    try:
+        yield active
+        active.join()
+    finally:
+        if active.executor is not None:
+            active.executor.shutdown(wait=True)
+        active = None
+
+
+def color_space(fn):
+    if fn.endswith('_linear_half' + PROCESSED_EXTENSION):
+        return 'LINEAR'
+    return 'SRGB'
@@ -0,0 +1,75 @@
+"""Stand-in for the luminous renderer, used to test the render engine integration.
+
+    python tools/stub_renderer.py --scene /out/scene.json --framebuffer /out/framebuffer.bin
+
+Loads scene.json, then fills the framebuffer with a synthetic image: the
+first pass tile by tile, later passes over the whole frame, converging like
+a progressive render would.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import framebuffer
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Write synthetic progressive images into a luminous framebuffer')
+    parser.add_argument('--scene', required=True)
+    parser.add_argument('--framebuffer', required=True)
+    parser.add_argument('--spp', type=int, default=16, help='passes, one sample each')
+    parser.add_argument('--tile', type=int, default=64)
+    parser.add_argument('--delay', type=float, default=0.05, help='seconds per pass')
+    return parser.parse_args(argv)
+
+
+def target_image(width, height, scene):
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    u = x / max(width - 1, 1)
+    v = y / max(height - 1, 1)
+    # one stripe per shape so different scenes look different
+    stripes = max(len(scene.get('shapes', [])), 1)
+    image = np.empty((height, width, framebuffer.CHANNELS), dtype=np.float32)
+    image[..., 0] = u
+    image[..., 1] = v
+    image[..., 2] = 0.5 + 0.5 * np.sin(u * stripes * np.pi)
+    image[..., 3] = 1
+    return image
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    with open(args.scene) as f:
+        scene = json.load(f)
+    rng = np.random.default_rng(0)
+    with framebuffer.MappedFramebuffer(args.framebuffer, write=True) as fb:
+        target = target_image(fb.width, fb.height, scene)
+        accum = np.zeros_like(target)
+        for spp in range(1, args.spp + 1):
+            noisy = target * rng.uniform(0.0, 2.0, size=target.shape).astype(np.float32)
+            accum += noisy
+            estimate = accum / spp
+            estimate[..., 3] = 1
+            if spp == 1:
+                for y in range(0, fb.height, args.tile):
+                    for x in range(0, fb.width, args.tile):
+                        h = min(args.tile, fb.height - y)
+                        w = min(args.tile, fb.width - x)
+                        fb.pixels[y:y + h, x:x + w] = estimate[y:y + h, x:x + w]
+                        fb.publish(spp, (x, y, w, h))
+            else:
+                fb.pixels[...] = estimate
+                fb.publish(spp, done=spp == args.spp)
+            time.sleep(args.delay)
+        if args.spp == 1:
+            fb.publish(1, done=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
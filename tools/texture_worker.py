@@ -0,0 +1,151 @@
+"""Texture preprocessing that runs in worker processes.
+
+Kept free of bpy and of the addon package (whose __init__ imports bpy) so
+spawned processes can import it by its plain module name.
+
+Output is a .lmtex file: a 32 byte header, a table with one
+(offset u64, width u32, height u32) record per mip level, then the levels,
+each 16 byte aligned, rows top to bottom, channels interleaved.
+"""
+import os
+import struct
+
+import numpy as np
+
+
+MAGIC = b'LMTX'
+VERSION = 1
+HEADER = struct.Struct('<4s7I')
+LEVEL = struct.Struct('<QII')
+ALIGNMENT = 16
+
+FORMAT_SRGB8 = 0
+FORMAT_LINEAR_HALF = 1
+FORMATS = {'SRGB8': FORMAT_SRGB8, 'LINEAR_HALF': FORMAT_LINEAR_HALF}
+
+# what pillow decodes, everything else is copied untouched
+EXTENSIONS = {'.png', '.jpg', '.jpeg', '.tga', '.bmp', '.tif', '.tiff', '.webp'}
+
+
+def srgb_to_linear(c):
+    return np.where(c <= 0.04045, c / 12.92, ((c + 0.055) / 1.055) ** 2.4)
+
+
+def linear_to_srgb(c):
+    c = np.clip(c, 0, 1)
+    return np.where(c <= 0.0031308, c * 12.92, 1.055 * c ** (1 / 2.4) - 0.055)
+
+
+# single channel 16 bit and float modes and the value that maps to 1, 16 bit
+# pngs open as 'I' or 'I;16' depending on the pillow version. These hold linear
+# data (height, roughness, displacement), they skip the srgb decode and are
+# written as LINEAR_HALF so values outside 0..1 survive
+HIGH_BIT_DEPTH = {'I;16': 65535, 'I;16L': 65535, 'I;16B': 65535, 'I;16N': 65535, 'I': 65535, 'F': 1}
+
+
+def fit_size(width, height, max_size):
+    if max_size > 0 and max(width, height) > max_size:
+        ratio = max_size / max(width, height)
+        return max(int(round(width * ratio)), 1), max(int(round(height * ratio)), 1)
+    return width, height
+
+
+def is_linear(srcfile):
+    # only reads the header
+    from PIL import Image
+    with Image.open(srcfile) as image:
+        return image.mode in HIGH_BIT_DEPTH
+
+
+def load_image(srcfile, max_size):
+    '''Returns (pixels, linear), float [height, width, channels] and whether they skip the srgb decode'''
+    from PIL import Image
+    with Image.open(srcfile) as image:
+        image.load()
+        size = fit_size(image.width, image.height, max_size)
+        if image.mode in HIGH_BIT_DEPTH:
+            # scale to 0..1 first, resizing then happens on float pixels
+            pixels = np.asarray(image, dtype=np.float32) / HIGH_BIT_DEPTH[image.mode]
+            if size != image.size:
+                pixels = np.asarray(Image.fromarray(pixels).resize(size, Image.LANCZOS))
+            return pixels[..., None], True
+        if image.mode not in ('L', 'LA', 'RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+        if size != image.size:
+            image = image.resize(size, Image.LANCZOS)
+        pixels = np.asarray(image, dtype=np.float32) / 255
+    if pixels.ndim == 2:
+        pixels = pixels[..., None]
+    return pixels, False
+
+
+def downsample(pixels):
+    # 2x2 box filter, odd edges are repeated
+    h, w = pixels.shape[:2]
+    if h % 2:
+        pixels = np.concatenate([pixels, pixels[-1:]], axis=0)
+    if w % 2:
+        pixels = np.concatenate([pixels, pixels[:, -1:]], axis=1)
+    return 0.25 * (pixels[0::2, 0::2] + pixels[1::2, 0::2] + pixels[0::2, 1::2] + pixels[1::2, 1::2])
+
+
+def mip_chain(linear):
+    levels = [linear]
+    while max(levels[-1].shape[:2]) > 1:
+        levels.append(downsample(levels[-1]))
+    return levels
+
+
+def encode_level(level, pixel_format, channels):
+    if pixel_format == FORMAT_LINEAR_HALF:
+        return np.ascontiguousarray(level, dtype='<f2')
+    encoded = level.copy()
+    color = min(channels, 3) if channels != 2 else 1
+    encoded[..., :color] = linear_to_srgb(encoded[..., :color])
+    return np.rint(np.clip(encoded, 0, 1) * 255).astype(np.uint8)
+
+
+def process_texture(srcfile, dstfile, max_size, format_name):
+    '''Decode, clamp, build mips and write dstfile, returns bytes written'''
+    pixel_format = FORMATS[format_name]
+    pixels, linear = load_image(srcfile, max_size)
+    height, width, channels = pixels.shape
+    # filter in linear space, alpha and grey+alpha's second channel stay as they are
+    if not linear:
+        color = min(channels, 3) if channels != 2 else 1
+        pixels[..., :color] = srgb_to_linear(pixels[..., :color])
+    levels = [encode_level(level, pixel_format, channels) for level in mip_chain(pixels)]
+
+    offset = HEADER.size + LEVEL.size * len(levels)
+    table = []
+    for level in levels:
+        offset += -offset % ALIGNMENT
+        table.append((offset, level.shape[1], level.shape[0]))
+        offset += level.nbytes
+
+    tmpfile = dstfile + '.tmp%d' % os.getpid()
+    with open(tmpfile, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, width, height, channels, len(levels), pixel_format, 0))
+        for entry in table:
+            f.write(LEVEL.pack(*entry))
+        for (level_offset, _, _), level in zip(table, levels):
+            f.write(b'\0' * (level_offset - f.tell()))
+            level.tofile(f)
+    # several textures can resolve to the same file, the last rename wins
+    os.replace(tmpfile, dstfile)
+    return offset
+
+
+def read_texture(filepath):
+    '''Returns (format, list of mip level arrays) from a .lmtex file'''
+    data = np.memmap(filepath, dtype=np.uint8, mode='r')
+    magic, version, width, height, channels, num_levels, pixel_format, _ = HEADER.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise ValueError('%s is not a luminous texture' % filepath)
+    dtype = np.dtype('<f2') if pixel_format == FORMAT_LINEAR_HALF else np.dtype(np.uint8)
+    levels = []
+    for i in range(num_levels):
+        offset, w, h = LEVEL.unpack_from(data, HEADER.size + i * LEVEL.size)
+        count = w * h * channels
+        levels.append(np.frombuffer(data, dtype=dtype, count=count, offset=offset).reshape(h, w, channels))
+    return pixel_format, levels
@@ -0,0 +1,49 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class BoundedWorkerPool:
+    '''Thread pool that blocks the submitting thread while too many bytes are queued'''
+    def __init__(self, max_workers=0, max_queued_bytes=1 << 30):
+        if max_workers <= 0:
+            max_workers = os.cpu_count() or 1
+        self.max_workers = max_workers
+        self.max_queued_bytes = max_queued_bytes
+        self.queued_bytes = 0
+        self.condition = threading.Condition()
+        self.futures = []
+        self.executor = ThreadPoolExecutor(max_workers=max_workers,
+                                           thread_name_prefix='luminous_export')
+
+    def submit(self, nbytes, fn, *args):
+        with self.condition:
+            # always admit a job into an empty queue so one huge mesh can't stall forever
+            while self.queued_bytes > 0 and self.queued_bytes + nbytes > self.max_queued_bytes:
+                self.condition.wait()
+            self.queued_bytes += nbytes
+        future = self.executor.submit(fn, *args)
+        future.add_done_callback(lambda f: self.release(nbytes))
+        self.futures.append(future)
+        return future
+
+    def release(self, nbytes):
+        with self.condition:
+            self.queued_bytes -= nbytes
+            self.condition.notify_all()
+
+    def join(self):
+        self.executor.shutdown(wait=True)
+        futures, self.futures = self.futures, []
+        # re-raise the first worker error on the calling thread
+        return [f.result() for f in futures]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.executor.shutdown(wait=True)
+            return False
+        self.join()
+        return False